@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Strong- and weak-scaling benchmark of LESSRegressor and LESSClassifier
+
+The driver runs the benchmark under mpirun for each number of ranks and prints
+the scaling tables with a breakdown of the fit into its phases (see lessmpi.Profiler):
+
+    python3 less-mpi-benchmark.py --ranks 1,2,4 --n 20000 --n-per-rank 5000
+
+Strong scaling fits n samples on every number of ranks, whereas weak scaling fits
+n-per-rank samples per rank. The data is synthetic (sklearn.datasets) and generated
+from the same seed on all ranks, so the runs are reproducible. With --output, the
+measurements and the profiler reports of all runs are written to a JSON file.
+'''
+
+import argparse
+import json
+import shlex
+import subprocess
+import sys
+
+# Columns of the phase breakdown: (header, phases), where the time of a column
+# is the sum over its phases of the time of the slowest rank
+PHASE_COLUMNS = [('scaling', ['scaling']),
+                 ('tree', ['tree', 'query']),
+                 ('local', ['local_fit']),
+                 ('comm', ['neighbors_comm', 'normalize_comm', 'features_comm']),
+                 ('global', ['global_fit'])]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scaling benchmark of LESS-MPI')
+    parser.add_argument('--tasks', default='regression,classification',
+                        help='comma separated tasks: regression, classification')
+    parser.add_argument('--ranks', default='1,2,4', help='comma separated numbers of MPI ranks')
+    parser.add_argument('--n', type=int, default=20000, help='number of training samples (strong scaling)')
+    parser.add_argument('--n-per-rank', type=int, default=5000,
+                        help='number of training samples per rank (weak scaling)')
+    parser.add_argument('--n-test', type=int, default=5000, help='number of test samples')
+    parser.add_argument('--d', type=int, default=10, help='number of features')
+    parser.add_argument('--n-subsets', type=int, default=None,
+                        help='number of subsets (default is LESS\'s default, frac=0.05)')
+    parser.add_argument('--n-classes', type=int, default=3, help='number of classes (classification)')
+    parser.add_argument('--multiclass', default='ovr', help='multiclass option of LESSClassifier')
+    parser.add_argument('--n-replications', type=int, default=4, help='number of replications')
+    parser.add_argument('--parallel-mode', default='subsets', help='parallel_mode of LESS')
+    parser.add_argument('--scheduler', default='static', help='scheduler of LESS')
+    parser.add_argument('--n-threads', type=int, default=1, help='number of threads per rank')
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='number of repetitions of each run (the fastest is reported)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the data and of LESS')
+    parser.add_argument('--mpirun', default='mpirun', help='MPI launcher (with its options)')
+    parser.add_argument('--output', default=None, help='JSON file for the measurements')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--task', default='regression', help=argparse.SUPPRESS)
+    parser.add_argument('--n-samples', type=int, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def make_data(args, n_samples):
+    '''
+    Synthetic training and test data (the same on every rank)
+    '''
+    from sklearn.datasets import make_classification, make_regression
+
+    n_total = n_samples + args.n_test
+    if args.task == 'regression':
+        X, y = make_regression(n_samples=n_total, n_features=args.d, n_informative=args.d,
+                               noise=1.0, random_state=args.seed)
+    else:
+        X, y = make_classification(n_samples=n_total, n_features=args.d, n_informative=args.d,
+                                   n_redundant=0, n_classes=args.n_classes, random_state=args.seed)
+    return X[:n_samples], y[:n_samples], X[n_samples:]
+
+
+def worker(args):
+    '''
+    One run under mpirun: fits and predicts, and prints the measurements on rank 0
+    '''
+    from mpi4py import MPI
+    from lessmpi import LESSClassifier, LESSRegressor, Profiler
+
+    comm = MPI.COMM_WORLD
+    X, y, X_test = make_data(args, args.n_samples)
+    params = dict(n_subsets=args.n_subsets, n_replications=args.n_replications,
+                  random_state=args.seed, parallel_mode=args.parallel_mode,
+                  scheduler=args.scheduler, n_threads=args.n_threads,
+                  parallel_predict=True, warnings=False)
+    if args.task == 'classification':
+        params['multiclass'] = args.multiclass
+
+    best = None
+    for _ in range(args.repeats):
+        profiler = Profiler()
+        model = (LESSRegressor if args.task == 'regression' else LESSClassifier)(profiler=profiler, **params)
+        comm.Barrier()
+        start = MPI.Wtime()
+        model.fit(X, y)
+        comm.Barrier()
+        fit_time = MPI.Wtime() - start
+        # The prediction time is not part of the fit report
+        report = profiler.report()
+        comm.Barrier()
+        start = MPI.Wtime()
+        model.predict(X_test)
+        comm.Barrier()
+        predict_time = MPI.Wtime() - start
+        if comm.Get_rank() == 0 and (best is None or fit_time < best['fit']):
+            best = {'fit': fit_time, 'predict': predict_time, 'report': report}
+
+    if comm.Get_rank() == 0:
+        print('RESULT ' + json.dumps(best), flush=True)
+
+
+def run(args, task, n_ranks, n_samples):
+    '''
+    Runs the worker on n_ranks ranks and returns its measurements
+    '''
+    command = shlex.split(args.mpirun) + ['-n', str(n_ranks), sys.executable, __file__, '--worker',
+        '--task', task, '--n-samples', str(n_samples), '--n-test', str(args.n_test),
+        '--d', str(args.d), '--n-classes', str(args.n_classes), '--multiclass', args.multiclass,
+        '--n-replications', str(args.n_replications), '--parallel-mode', args.parallel_mode,
+        '--scheduler', args.scheduler, '--n-threads', str(args.n_threads),
+        '--repeats', str(args.repeats), '--seed', str(args.seed)]
+    if args.n_subsets is not None:
+        command += ['--n-subsets', str(args.n_subsets)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    raise RuntimeError('The benchmark failed on {} ranks:\n{}'.format(n_ranks, completed.stderr))
+
+
+def phase_time(report, phases):
+    '''
+    Sum over the phases of the time of the slowest rank
+    '''
+    return sum(report['phases'][phase]['max'] for phase in phases if phase in report['phases'])
+
+
+def print_table(title, rows, weak):
+    '''
+    Prints a scaling table, where rows are (n_ranks, n_samples, measurements)
+    '''
+    print('\n' + title)
+    headers = ['ranks', 'n', 'fit[s]', 'speedup' if not weak else 'scaled', 'efficiency', 'predict[s]'] + \
+        [header + '[s]' for header, _ in PHASE_COLUMNS] + ['imbalance']
+    print(''.join('{:>12}'.format(header) for header in headers))
+    base_ranks, _, base = rows[0]
+    for n_ranks, n_samples, result in rows:
+        # Weak scaling is ideal if the fit time does not change with the ranks
+        speedup = base['fit'] / result['fit'] * (n_ranks / base_ranks if weak else 1.0)
+        efficiency = speedup * base_ranks / n_ranks
+        local_fit = result['report']['phases'].get('local_fit')
+        values = [n_ranks, n_samples, result['fit'], speedup, efficiency, result['predict']] + \
+            [phase_time(result['report'], phases) for _, phases in PHASE_COLUMNS] + \
+            [local_fit['imbalance'] if local_fit is not None else 1.0]
+        print(''.join('{:>12}'.format(value) if isinstance(value, int) else '{:>12.3f}'.format(value)
+                      for value in values))
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        worker(args)
+        return
+
+    ranks = [int(n_ranks) for n_ranks in args.ranks.split(',')]
+    results = []
+    for task in args.tasks.split(','):
+        for mode in ('strong', 'weak'):
+            rows = []
+            for n_ranks in ranks:
+                n_samples = args.n if mode == 'strong' else args.n_per_rank * n_ranks
+                result = run(args, task, n_ranks, n_samples)
+                rows.append((n_ranks, n_samples, result))
+                results.append({'task': task, 'scaling': mode, 'ranks': n_ranks, 'n': n_samples, **result})
+            print_table('{} scaling, {} (d={}, replications={})'.format(
+                mode.capitalize(), task, args.d, args.n_replications), rows, mode == 'weak')
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'arguments': vars(args), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ from sklearn.metrics import mean_squared_error
 from mpi4py import MPI
 import time
 import datasets as DS
-from lessmpi import LESSRegressor
+from lessmpi import LESSRegressor, shared_array, get_node_comm
 
 
 comm = MPI.COMM_WORLD
@@ -12,31 +12,23 @@ rank = comm.Get_rank()
 
 split_size = 0.1
 random_state = 1234
-df = np.array(DS.energy('./datasets/'))
-X, y = df[:, 0:-1], df[:, -1]
 
-if(rank == 0):
+# Only the first rank of each node reads the data, the other ranks
+# on the node access the training set through shared memory
+# (with copy_X=False, LESS scales this single copy in place)
+if(get_node_comm().Get_rank() == 0):
+  df = np.array(DS.energy('./datasets/'))
+  X, y = df[:, 0:-1], df[:, -1]
   X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=split_size,random_state=random_state)
-
 else:
-  len_x_test = int(len(X) * split_size)
-  len_y_test = int(len(X) * split_size)
-  len_x_train = int(len(X) * (1-split_size))
-  len_y_train = int(len(y) * (1-split_size))
-  X_train = np.empty((len_x_train,X[0].shape[0]))
-  y_train = np.empty(len_y_train)
-  X_test = np.empty((len_x_test,X[0].shape[0]))
-  y_test = np.empty(len_y_test)
-
+  X_train, y_train = None, None
 
-X_train = comm.bcast(X_train, root=0)
-X_test = comm.bcast(X_test, root=0)
-y_train = comm.bcast(y_train, root=0)
-y_test = comm.bcast(y_test, root=0)
+X_train = shared_array(X_train)
+y_train = shared_array(y_train)
 
 if(rank == 0):
   start_time = time.time()
-LESS_fit = LESSRegressor(random_state=random_state).fit(X_train, y_train)
+LESS_fit = LESSRegressor(random_state=random_state, shared_memory=True, copy_X=False).fit(X_train, y_train)
 
 if(rank == 0):
   end_time = time.time()
@@ -1,3 +1,12 @@
 
 from .lessmpi import LESSRegressor
 from .lessmpi import LESSClassifier
+from .lessmpi import rbf_batch
+from .lessmpi import batched
+from .lessmpi import shared_array
+from .lessmpi import get_node_comm
+from .lessmpi import IVFIndex
+from .lessmpi import MPIKMeans
+from .lessmpi import save_model
+from .lessmpi import load_model
+from .lessmpi import Profiler
@@ -3,18 +3,32 @@
 """
 @author: Ilker Birbil @ UvA
 """
+import json
+import pickle
+import struct
+import threading
+import time
 import warnings
+import zipfile
+import collections.abc
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from typing import List, Optional, Callable, NamedTuple
-from sklearn.base import is_classifier, is_regressor
-from sklearn.base import RegressorMixin, BaseEstimator, ClassifierMixin
+from sklearn.base import is_classifier, is_regressor, clone
+from sklearn.base import RegressorMixin, BaseEstimator, ClassifierMixin, ClusterMixin
 from sklearn.multiclass import OneVsOneClassifier, OneVsRestClassifier, OutputCodeClassifier
 from sklearn.neighbors import KDTree
 from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression, Ridge, RidgeCV, Lasso, LassoCV, ElasticNet, ElasticNetCV
+from sklearn.linear_model import Lars, LarsCV, LassoLars, LassoLarsCV, LassoLarsIC, BayesianRidge, ARDRegression
+from sklearn.linear_model import OrthogonalMatchingPursuit, OrthogonalMatchingPursuitCV, HuberRegressor
+from sklearn.linear_model import TheilSenRegressor, QuantileRegressor, SGDRegressor, PassiveAggressiveRegressor
+from sklearn.svm import LinearSVR
+from sklearn.preprocessing import StandardScaler, LabelBinarizer
 from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
 from sklearn.utils.validation import check_X_y, check_array, check_is_fitted
+from scipy.sparse import csr_matrix, issparse
 from scipy.stats import mode
 from mpi4py import MPI
 
@@ -22,6 +36,23 @@ comm = MPI.COMM_WORLD
 number_of_workers=comm.Get_size()
 rank = comm.Get_rank()
 
+# Message tags of the dynamic scheduler
+_TAG_JOB_REQUEST = 11
+_TAG_JOB_ASSIGN = 12
+
+# Random streams of a replication (see _LESS._replication_rng)
+_STREAM_SPLIT = 0
+_STREAM_ANCHORS = 1
+_STREAM_CLUSTER = 2
+_STREAM_GLOBAL = 3
+
+# Communicator of the ranks sharing memory (created on first use)
+_node_comm = None
+# Windows of the arrays created by shared_array (kept alive until exit)
+_shared_windows = []
+# Memory ranges (start, stop) of the arrays created by shared_array
+_shared_ranges = []
+
 
 ############################
 warnings.formatwarning = lambda msg, *args, **kwargs: f'\nWARNING: \n'+' '.join(str(msg).split())+'\n'
@@ -55,6 +86,8 @@ class LocalModelR(NamedTuple):
     '''
     estimator: SklearnEstimator
     center: np.array
+    # Sufficient statistics (Z^T Z, Z^T y) with Z = [1, X] of the subset (online)
+    stats: Optional[tuple] = None
 
 class ReplicationR(NamedTuple):
     '''
@@ -63,6 +96,15 @@ class ReplicationR(NamedTuple):
     global_estimator: SklearnEstimator
     local_estimators: List[LocalModelR]
 
+class CompiledReplicationR(NamedTuple):
+    '''
+    Auxiliary class to hold the stacked parameters of the local estimators
+    of a replication (coefs and intercepts are None unless all local estimators are linear)
+    '''
+    centers: np.array
+    coefs: Optional[np.array]
+    intercepts: Optional[np.array]
+
 ############################
 
 ############################
@@ -73,8 +115,501 @@ def rbf(data, center, coeff=0.01):
     '''
     return np.exp(-coeff * np.linalg.norm(np.array(data - center, dtype=float), ord=2, axis=1))
 
+def rbf_batch(data, centers, coeff=0.01, block_size=None):
+    '''
+    RBF kernel - L2 norm, evaluated for all centers at once
+    Returns the len(data) x len(centers) kernel matrix. The squared distances are
+    expanded as ||x||^2 + ||c||^2 - 2xc, and if block_size is given, the matrix
+    is filled block_size rows at a time to bound the temporary memory
+    '''
+    centers = np.asarray(centers, dtype=float)
+    len_data = len(data)
+    if block_size is None:
+        block_size = max(len_data, 1)
+    sqcenters = np.einsum('ij,ij->i', centers, centers)
+    kernel = np.empty((len_data, len(centers)))
+    for start in range(0, len_data, block_size):
+        block = np.asarray(data[start:start+block_size], dtype=float)
+        out = kernel[start:start+block_size]
+        np.matmul(block, centers.T, out=out)
+        out *= -2.0
+        out += np.einsum('ij,ij->i', block, block)[:, np.newaxis]
+        out += sqcenters
+        np.maximum(out, 0.0, out=out)
+        np.sqrt(out, out=out)
+        out *= -coeff
+        np.exp(out, out=out)
+    return kernel
+
+def get_node_comm():
+    '''
+    Returns the communicator of the ranks on the same node (shared memory).
+    The first call must be made by all ranks.
+    '''
+    global _node_comm
+    if _node_comm is None:
+        _node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    return _node_comm
+
+def _shared_window(array):
+    '''
+    Allocates an MPI-3 shared-memory window on each node and copies the array
+    of the first rank of the node into it. Returns the array backed by the
+    window on all ranks, and the window itself (to be freed by the caller).
+    '''
+    node_comm = get_node_comm()
+    if node_comm.Get_rank() == 0:
+        array = np.ascontiguousarray(array)
+        shape, dtype = node_comm.bcast((array.shape, array.dtype.str), root=0)
+    else:
+        shape, dtype = node_comm.bcast(None, root=0)
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize if node_comm.Get_rank() == 0 else 0
+    window = MPI.Win.Allocate_shared(nbytes, dtype.itemsize, comm=node_comm)
+    buffer, _ = window.Shared_query(0)
+    shared = np.ndarray(shape, dtype=dtype, buffer=buffer)
+    if node_comm.Get_rank() == 0:
+        shared[...] = array
+    node_comm.Barrier()
+    return shared, window
+
+def shared_array(array=None):
+    '''
+    Places an array in shared memory so that all ranks on a node use a single copy.
+    Only the first rank of each node (get_node_comm().Get_rank() == 0) needs to
+    provide the array, the other ranks may pass None. Must be called by all ranks.
+    '''
+    shared, window = _shared_window(array)
+    _shared_windows.append(window)
+    start = shared.__array_interface__['data'][0]
+    _shared_ranges.append((start, start + shared.nbytes))
+    return shared
+
+def _is_shared(array):
+    '''
+    Returns True if the array (or the view) lies in an array created by shared_array
+    '''
+    if not isinstance(array, np.ndarray) or array.size == 0:
+        return False
+    start = array.__array_interface__['data'][0]
+    return any(low <= start < high for low, high in _shared_ranges)
+
+def _alltoallv(arrays):
+    '''
+    Sends arrays[j] to rank j and returns the list of the arrays received from
+    each rank (all arrays have the same dtype and the same trailing dimensions)
+    '''
+    trailing_shape = arrays[0].shape[1:]
+    row_size = int(np.prod(trailing_shape))
+    sendcounts = np.array([len(array) for array in arrays], dtype='i')
+    recvcounts = np.zeros(number_of_workers, dtype='i')
+    comm.Alltoall(sendcounts, recvcounts)
+    sendbuf = np.ascontiguousarray(np.concatenate(arrays))
+    recvbuf = np.empty((np.sum(recvcounts),) + trailing_shape, dtype=sendbuf.dtype)
+    senddispls = np.cumsum([0] + list(sendcounts[:-1]))
+    recvdispls = np.cumsum([0] + list(recvcounts[:-1]))
+    comm.Alltoallv([sendbuf, (sendcounts*row_size, senddispls*row_size)],
+                   [recvbuf, (recvcounts*row_size, recvdispls*row_size)])
+    return np.split(recvbuf, np.cumsum(recvcounts)[:-1])
+
+def _inverted_index(nearest, n_subsets):
+    '''
+    Returns, for each subset, the positions (in nearest.ravel()) of the samples
+    having the subset among their nearest ones
+    '''
+    flat = nearest.ravel()
+    order = np.argsort(flat, kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=n_subsets))))
+    return [order[bounds[s]:bounds[s+1]] for s in range(n_subsets)]
+
+def _sqeuclidean(data, centers):
+    '''
+    Squared Euclidean distances between the rows of data and the rows of centers
+    '''
+    sqdists = data @ centers.T
+    sqdists *= -2.0
+    sqdists += np.einsum('ij,ij->i', data, data)[:, np.newaxis]
+    sqdists += np.einsum('ij,ij->i', centers, centers)
+    return np.maximum(sqdists, 0.0, out=sqdists)
+
+def batched(distance_function):
+    '''
+    Marks a distance function that evaluates all subsets at once, i.e.,
+    df(data, centers) returns the len(data) x len(centers) matrix of distances
+    '''
+    distance_function.batched = True
+    return distance_function
+
+# Linear regressors predicting X @ coef_ + intercept_ (identity link), whose local
+# models are compiled; e.g., the generalized linear models (PoissonRegressor) are not
+_IDENTITY_LINEAR_MODELS = (LinearRegression, Ridge, RidgeCV, Lasso, LassoCV, ElasticNet, ElasticNetCV,
+                           Lars, LarsCV, LassoLars, LassoLarsCV, LassoLarsIC, BayesianRidge, ARDRegression,
+                           OrthogonalMatchingPursuit, OrthogonalMatchingPursuitCV, HuberRegressor,
+                           TheilSenRegressor, QuantileRegressor, SGDRegressor, PassiveAggressiveRegressor,
+                           LinearSVR)
+
+def _linear_parameters(estimator):
+    '''
+    Returns the coefficients and the intercept of a fitted linear regressor,
+    or None if the predictions of the estimator are not of the form X @ coef + intercept
+    (for multi-output regressors, coef has a row and intercept an entry for each output)
+    '''
+    if not isinstance(estimator, _IDENTITY_LINEAR_MODELS):
+        return None
+    coef = getattr(estimator, 'coef_', None)
+    intercept = getattr(estimator, 'intercept_', None)
+    if coef is None or intercept is None:
+        return None
+    if np.ndim(coef) == 2 and np.ndim(intercept) == 1 and np.shape(coef)[0] == np.size(intercept):
+        return np.asarray(coef, dtype=float), np.asarray(intercept, dtype=float)
+    if np.ndim(coef) != 1 or np.size(intercept) != 1:
+        return None
+    return np.asarray(coef, dtype=float), float(np.ravel(intercept)[0])
+
+############################
+
+############################
+# Approximate nearest neighbors
+
+class IVFIndex:
+    '''
+    Approximate nearest neighbor index with an inverted file (IVF) structure
+
+    The samples are assigned to the nearest of n_lists centroids found by a few
+    k-means iterations, and a query only scans the samples in the lists of its
+    n_probe nearest centroids. Larger n_probe values give higher recall at the
+    cost of speed (n_probe >= n_lists gives exact neighbors). The index can be used
+    in place of the nearest neighbor tree of LESS, e.g.,
+
+    >>> LESSRegressor(tree_method=lambda data, n_subsets: IVFIndex(data, n_probe=8))
+
+    Parameters
+    ----------
+        data : samples to be indexed
+        n_lists : number of inverted lists (default is sqrt(len(data)))
+        n_probe : number of lists scanned by each query (default is 4)
+        n_iter : number of k-means iterations for the centroids (default is 10)
+        sample_size : number of samples used for the k-means iterations (default is 256 x n_lists)
+        random_state : initialization of the random seed (default is 0, so that
+                all ranks build the same index)
+    '''
+
+    def __init__(self, data, n_lists=None, n_probe=4, n_iter=10, sample_size=None, random_state=0):
+
+        self.data = np.asarray(data, dtype=float)
+        len_data = len(self.data)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len_data))
+        self.n_lists = max(1, min(n_lists, len_data))
+        self.n_probe = n_probe
+        rng = np.random.default_rng(random_state)
+
+        # Coarse quantizer: k-means on a sample of the data
+        if sample_size is None:
+            sample_size = 256 * self.n_lists
+        sample = self.data[rng.choice(len_data, size=min(sample_size, len_data), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), size=self.n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = np.argmin(_sqeuclidean(sample, self.centroids), axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=self.n_lists)
+            nonempty = counts > 0
+            self.centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+
+        # Inverted lists: the samples sorted by their nearest centroid
+        labels = np.argmin(_sqeuclidean(self.data, self.centroids), axis=1)
+        self.list_indices = np.argsort(labels, kind='stable')
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=self.n_lists))))
+
+    def query(self, X, k=1):
+        '''
+        Returns the distances and the indices of the (approximate) k nearest
+        neighbors of the samples in X, sorted by increasing distance
+        '''
+        X = np.asarray(X, dtype=float)
+        if k > len(self.data):
+            raise ValueError('k must be less than or equal to the number of indexed samples.')
+        dists = np.zeros((len(X), k))
+        indices = np.zeros((len(X), k), dtype=int)
+        list_order = np.argsort(_sqeuclidean(X, self.centroids), axis=1)
+        list_sizes = np.diff(self.list_offsets)
+        for i, x in enumerate(X):
+            # Probe at least n_probe lists and enough lists to hold k candidates
+            n_probe = max(self.n_probe, np.searchsorted(np.cumsum(list_sizes[list_order[i]]), k) + 1)
+            candidates = np.concatenate([self.list_indices[self.list_offsets[l]:self.list_offsets[l+1]]
+                                         for l in list_order[i, :n_probe]])
+            sqdists = _sqeuclidean(x[np.newaxis, :], self.data[candidates])[0]
+            nearest = np.argpartition(sqdists, k-1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            nearest = nearest[np.argsort(sqdists[nearest], kind='stable')]
+            dists[i] = np.sqrt(sqdists[nearest])
+            indices[i] = candidates[nearest]
+        return dists, indices
+
+############################
+
+############################
+# Distributed clustering
+
+class MPIKMeans(BaseEstimator, ClusterMixin):
+    '''
+    k-means clustering distributed over the MPI ranks
+
+    Every rank computes the assignments and the partial centroid sums of its own
+    block of rows, and the sums of all ranks are combined with a single Allreduce
+    per iteration. With batch_size, each iteration uses a random mini-batch
+    (drawn from the same random stream on all ranks, where each rank takes the
+    samples of its own rows, so that the clusters do not depend on the number of
+    ranks) and the centroids are updated as in mini-batch k-means. The initial centroids are
+    chosen by k-means++ on a sample of the data. Unlike the other clustering
+    methods, LESS fits MPIKMeans on all ranks, e.g.,
+
+    >>> LESSRegressor(cluster_method=lambda: MPIKMeans(n_clusters=20))
+
+    Parameters
+    ----------
+        n_clusters : number of clusters (default is 8)
+        batch_size : total number of samples in each mini-batch (default is None,
+                i.e., all samples are used in each iteration)
+        max_iter : maximum number of iterations (default is 100)
+        tol : tolerance on the movement of the centroids, relative to the
+                variance of the data (default is 1e-4)
+        random_state : initialization of the random seed (default is None)
+    '''
+
+    # LESS fits the method on all ranks
+    _mpi_collective = True
+
+    def __init__(self, n_clusters=8, batch_size=None, max_iter=100, tol=1e-4, random_state=None):
+
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+
+    def _local_rows(self, len_X):
+        '''
+        Returns the block of rows assigned to this rank
+        '''
+        return slice(rank * len_X // number_of_workers, (rank + 1) * len_X // number_of_workers)
+
+    def _init_centers(self, X, rng):
+        '''
+        Returns the indices of the initial centroids chosen by (greedy) k-means++
+        on a sample of X
+        '''
+        sample_indices = rng.choice(len(X), size=min(len(X), 100 * self.n_clusters), replace=False)
+        sample = X[sample_indices]
+        init_indices = [rng.integers(len(sample))]
+        sqdists = np.maximum(_sqeuclidean(sample, sample[init_indices])[:, 0], 0.0)
+        # Number of candidates tried for each centroid (as in scikit-learn)
+        n_trials = 2 + int(np.log(self.n_clusters))
+        for _ in range(1, self.n_clusters):
+            if sqdists.sum() > 0:
+                candidates = rng.choice(len(sample), size=n_trials, p=sqdists/sqdists.sum())
+            else:
+                candidates = rng.choice(np.setdiff1d(np.arange(len(sample)), init_indices), size=1)
+            # The candidate that reduces the potential the most is kept
+            candidate_sqdists = np.minimum(sqdists[:, np.newaxis],
+                                           np.maximum(_sqeuclidean(sample, sample[candidates]), 0.0))
+            best = np.argmin(candidate_sqdists.sum(axis=0))
+            init_indices.append(candidates[best])
+            sqdists = candidate_sqdists[:, best]
+        return sample_indices[init_indices]
+
+    def _reduce_sums(self, X_local, labels):
+        '''
+        Returns the sums and the numbers of the samples in each cluster over all ranks
+        '''
+        n_features = self.cluster_centers_.shape[1]
+        # Sums and counts travel in one buffer
+        buffer = np.zeros((self.n_clusters, n_features + 1))
+        np.add.at(buffer[:, :n_features], labels, X_local)
+        buffer[:, n_features] = np.bincount(labels, minlength=self.n_clusters)
+        comm.Allreduce(MPI.IN_PLACE, buffer, op=MPI.SUM)
+        return buffer[:, :n_features], buffer[:, n_features]
+
+    def fit(self, X, y=None):
+        '''
+        Computes the clusters (must be called on all ranks with the same X)
+        '''
+
+        X = check_array(X)
+        len_X = len(X)
+        if self.n_clusters < 1 or self.n_clusters > len_X:
+            raise ValueError('Parameter n_clusters should be in the interval [1, number of samples].')
+        X_local = X[self._local_rows(len_X)]
+
+        # Rank 0 picks the initial centroids and the seed of the mini-batches
+        init_indices = np.zeros(self.n_clusters, dtype='i')
+        seed = np.zeros(1, dtype='i')
+        if rank == 0:
+            rng = np.random.default_rng(self.random_state)
+            init_indices[:] = self._init_centers(X, rng)
+            seed[:] = rng.integers(np.iinfo(np.int32).max)
+        comm.Bcast(init_indices, root=0)
+        comm.Bcast(seed, root=0)
+        rng = np.random.default_rng(seed[0])
+        self.cluster_centers_ = X[init_indices].astype(float)
+
+        # The tolerance is scaled with the mean variance of the features
+        moments = np.array([X_local.sum(axis=0), (X_local**2).sum(axis=0)])
+        comm.Allreduce(MPI.IN_PLACE, moments, op=MPI.SUM)
+        tol = self.tol * np.mean(moments[1] / len_X - (moments[0] / len_X)**2)
+
+        if self.batch_size is not None:
+            local_rows = self._local_rows(len_X)
+            total_counts = np.zeros(self.n_clusters)
+
+        for self.n_iter_ in range(1, self.max_iter + 1):
+            if self.batch_size is None:
+                X_batch = X_local
+            else:
+                # All ranks draw the same mini-batch and keep the samples of their rows
+                batch = np.sort(rng.choice(len_X, size=min(self.batch_size, len_X), replace=False))
+                X_batch = X[batch[(batch >= local_rows.start) & (batch < local_rows.stop)]]
+            labels = np.argmin(_sqeuclidean(X_batch, self.cluster_centers_), axis=1)
+            sums, counts = self._reduce_sums(X_batch, labels)
+            nonempty = counts > 0
+            centers = self.cluster_centers_.copy()
+            if self.batch_size is None:
+                centers[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+            else:
+                # Each centroid moves with the learning rate 1/(number of samples seen)
+                total_counts += counts
+                centers[nonempty] += (sums[nonempty] - counts[nonempty, np.newaxis] * centers[nonempty]) \
+                    / total_counts[nonempty, np.newaxis]
+            shift = np.sum((centers - self.cluster_centers_)**2)
+            self.cluster_centers_ = centers
+            if shift <= tol:
+                break
+
+        # Final assignments of all samples
+        labels = np.argmin(_sqeuclidean(X_local, self.cluster_centers_), axis=1).astype('i')
+        sqdists = _sqeuclidean(X_local, self.cluster_centers_)[np.arange(len(X_local)), labels]
+        inertia = np.array([np.sum(np.maximum(sqdists, 0.0))])
+        comm.Allreduce(MPI.IN_PLACE, inertia, op=MPI.SUM)
+        self.inertia_ = inertia[0]
+        self.labels_ = np.zeros(len_X, dtype='i')
+        counts = [(r + 1) * len_X // number_of_workers - r * len_X // number_of_workers
+                  for r in range(number_of_workers)]
+        comm.Allgatherv(labels, [self.labels_, counts, np.cumsum([0] + counts[:-1]), MPI.INT])
+        return self
+
+    def predict(self, X):
+        '''
+        Returns the index of the nearest centroid of each sample in X
+        '''
+        check_is_fitted(self, 'cluster_centers_')
+        X = check_array(X)
+        return np.argmin(_sqeuclidean(X, self.cluster_centers_), axis=1)
+
+############################
+
+############################
+# Profiling
+############################
+
+class Profiler:
+    '''
+    Records the wall time of the phases of fit and predict (e.g., 'tree', 'query',
+    'local_fit', 'global_fit') on each MPI rank, also per replication where it applies,
+    and the bytes of the buffers passed to the collectives (e.g., 'neighbors_comm',
+    'features_comm'). The objects passed to the pickle-based collectives (e.g., the
+    local models in 'local_models_comm' and 'share_replications') are recorded with
+    their pickled size, which is computed only when profiling; the small messages of
+    sizes, seeds and the job requests of the dynamic scheduler are not recorded.
+    The records of all ranks are aggregated by report.
+
+    >>> profiler = Profiler()
+    >>> model = LESSRegressor(profiler=profiler).fit(X, y)
+    >>> report = profiler.report()  # called by all ranks, returned on rank 0
+    '''
+
+    def __init__(self):
+        # The phases may be timed by several threads (n_threads)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __deepcopy__(self, memo):
+        # The estimators cloned by the multiclass strategies share the profiler
+        return self
+
+    def reset(self):
+        '''
+        Clears the records
+        '''
+
+        # Phase name -> [seconds, calls]
+        self.phases = {}
+        # (phase name, replication) -> seconds
+        self.replications = {}
+        # Collective name -> [bytes, calls]
+        self.messages = {}
+
+    @contextmanager
+    def phase(self, name: str, replication: Optional[int] = None):
+        '''
+        Context manager timing a phase (of the given replication)
+        '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                record = self.phases.setdefault(name, [0.0, 0])
+                record[0] += elapsed
+                record[1] += 1
+                if replication is not None:
+                    key = (name, int(replication))
+                    self.replications[key] = self.replications.get(key, 0.0) + elapsed
+
+    def communicated(self, name: str, nbytes: int):
+        '''
+        Records the bytes of a buffer (or of a pickled object) passed to a collective
+        '''
+
+        with self._lock:
+            record = self.messages.setdefault(name, [0, 0])
+            record[0] += int(nbytes)
+            record[1] += 1
+
+    def report(self, root: int = 0):
+        '''
+        Gathers the records of all ranks (a collective call) and returns on the root
+        a dictionary (which can be written with json.dump) holding for each phase the
+        seconds and calls per rank, their maximum and mean, and the load imbalance
+        (maximum over mean, 1.0 is balanced), the seconds per replication and rank,
+        and for each collective the bytes and calls per rank. Returns None on the other ranks.
+        '''
+
+        records = comm.gather((self.phases, self.replications, self.messages), root=root)
+        if rank != root:
+            return None
+
+        report = {'n_ranks': number_of_workers, 'phases': {}, 'replications': {}, 'communication': {}}
+        for name in sorted(set().union(*(phases for phases, _, _ in records))):
+            seconds = np.array([phases.get(name, [0.0, 0])[0] for phases, _, _ in records])
+            mean = float(np.mean(seconds))
+            report['phases'][name] = {'seconds': seconds.tolist(),
+                                      'calls': [phases.get(name, [0.0, 0])[1] for phases, _, _ in records],
+                                      'max': float(np.max(seconds)), 'mean': mean,
+                                      'imbalance': float(np.max(seconds))/mean if mean > 0 else 1.0}
+        for name, replication in sorted(set().union(*(replications for _, replications, _ in records))):
+            report['replications'].setdefault(name, {})[str(replication)] = \
+                [replications.get((name, replication), 0.0) for _, replications, _ in records]
+        for name in sorted(set().union(*(messages for _, _, messages in records))):
+            nbytes = [messages.get(name, [0, 0])[0] for _, _, messages in records]
+            report['communication'][name] = {'bytes': nbytes, 'total': sum(nbytes),
+                                             'calls': [messages.get(name, [0, 0])[1] for _, _, messages in records]}
+        return report
+
 ############################
 
+
 class _LESS(BaseEstimator, SklearnEstimator):
     '''
     The base class for LESSRegressor and LESSClassifier
@@ -88,6 +623,8 @@ class _LESS(BaseEstimator, SklearnEstimator):
         self._scobject = None
         # Flag to check whether LESS is fitted 
         self._isfitted = False
+        # Nearest neighbor tree of the last training set (used during fitting)
+        self._tree_cache = None
 
     def _set_local_attributes(self):
         '''
@@ -126,6 +663,32 @@ class _LESS(BaseEstimator, SklearnEstimator):
         if self.n_replications < 1:
             raise ValueError('The number of replications should greater than equal to one.')
 
+        if self.parallel_mode not in ('subsets', 'replications'):
+            raise ValueError('Parameter parallel_mode should be either \'subsets\' or \'replications\'.')
+
+        if self.scheduler not in ('static', 'dynamic'):
+            raise ValueError('Parameter scheduler should be either \'static\' or \'dynamic\'.')
+
+        if self.n_threads < 1:
+            raise ValueError('The number of threads should be greater than or equal to one.')
+
+        if self.distance_block_size is not None and self.distance_block_size < 1:
+            raise ValueError('Parameter distance_block_size should be greater than or equal to one.')
+
+        if self.online:
+            # update solves the ordinary least squares problem of each subset
+            local_model = self.local_estimator()
+            if not isinstance(local_model, LinearRegression) or not local_model.fit_intercept \
+                or local_model.positive:
+                raise ValueError('Parameter online requires LinearRegression local estimators with an intercept.')
+            if self.online_sample_size < 1:
+                raise ValueError('Parameter online_sample_size should be greater than or equal to one.')
+            if self.val_size is not None:
+                _LESSwarn('''
+                         Parameter val_size is ignored by update, which refits the
+                         global estimators on samples used by the local estimators.
+                         ''', self.warnings)
+
         if self.cluster_method is not None:                       
             if self.frac is not None \
                 or self.n_neighbors is not None \
@@ -161,6 +724,84 @@ class _LESS(BaseEstimator, SklearnEstimator):
              self.n_subsets is None):
             self.frac = 0.05
     
+    def _phase(self, name: str, replication: Optional[int] = None):
+        '''
+        Returns the context timing a phase with the profiler (if given)
+        '''
+
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name, replication)
+
+    def _communicated(self, name: str, *buffers):
+        '''
+        Records the bytes of the buffers of a collective with the profiler (if given)
+        '''
+
+        if self.profiler is not None:
+            self.profiler.communicated(name, sum(buffer.nbytes for buffer in buffers))
+
+    def _communicated_object(self, name: str, obj):
+        '''
+        Records the pickled size of an object passed to a collective (comm.bcast,
+        comm.gather or comm.allgather) with the profiler (if given)
+        '''
+
+        if self.profiler is not None:
+            self.profiler.communicated(name, len(MPI.pickle.dumps(obj)))
+
+    def _warm(self):
+        '''
+        Returns True if the replications of the previous fit are kept (warm_start)
+        '''
+
+        return self.warm_start and getattr(self, '_isfitted', False)
+
+    def _prepare_fit(self):
+        '''
+        Checks the parameters and sets the first replication to be fitted:
+        with warm_start, the replications of the previous fit are kept
+        '''
+
+        n_fitted = self._n_fitted if self._warm() else 0
+        n_subsets = self.n_subsets
+        self._set_local_attributes()
+        if n_fitted > self.n_replications:
+            raise ValueError('Parameter n_replications should be greater than or equal to the \
+                             number of fitted replications when warm_start is set.')
+        if n_fitted == self.n_replications:
+            _LESSwarn('''
+                     Fitting with warm_start without increasing n_replications
+                     does not fit new replications.
+                     ''', self.warnings)
+        if n_fitted > 0 and self.cluster_method is not None:
+            # Numbers of subsets of the fitted replications
+            self.n_subsets = n_subsets
+        self._first_replication = n_fitted
+        # Index of the first replication of the next call of _fit_helper (profiling)
+        self._next_replication = n_fitted
+        if n_fitted == 0:
+            self._replications = []
+            self._compiled = []
+        if n_fitted == 0 or getattr(self, '_seed_base', None) is None:
+            # Base seed of the replications (kept with warm_start),
+            # see _replication_rng and _local_seed
+            seed = np.zeros(1, dtype='i')
+            if rank == 0:
+                seed[:] = self._rng.integers(np.iinfo(np.int32).max)
+            comm.Bcast(seed, root=0)
+            self._seed_base = int(seed[0])
+
+    def _finish_fit(self):
+        '''
+        Shares and compiles the fitted replications
+        '''
+
+        self._share_replications()
+        self._compile_replications()
+        self._n_fitted = self.n_replications
+        self._isfitted = True
+
     def _check_input(self, len_X: int):
         '''
         Checks whether the input is valid (len_X is the length of input data)
@@ -210,63 +851,758 @@ class _LESS(BaseEstimator, SklearnEstimator):
                              ''', self.warnings)
                     self.n_replications = 1
 
-    def _fit_helper(self,X,y,neighbor_indices_list, Xval = None):
-        if rank < ((self.n_subsets) % number_of_workers):
-            start = rank * (int((self.n_subsets/number_of_workers))+1)
-            stop = start + int((self.n_subsets/number_of_workers))
+    def _scale_training_data(self, X: np.array):
+        '''
+        Fits the scaling object and returns the training data, together with
+        the shared-memory window holding it (None unless shared_memory is set).
+        Unless a scaled copy is made (copy_X without shared_memory), the scaling
+        statistics are computed collectively and the data is scaled in place.
+        '''
+
+        if not self.shared_memory:
+            if self.copy_X:
+                if (self.scaling):
+                    if not self._warm():
+                        self._scobject = StandardScaler().fit(X)
+                    X = self._scobject.transform(X)
+                return X, None
+            # The caller allows overwriting X (a read-only X is copied)
+            X = np.asarray(X)
+            if not np.issubdtype(X.dtype, np.floating) or not X.flags.writeable:
+                X = X.astype(float)
+            if (self.scaling):
+                mean, scale = self._fit_scaler(X)
+                X -= mean
+                X /= scale
+            return X, None
+
+        # A training set created by shared_array is used as such (on all ranks),
+        # unless a scaled copy is requested
+        reuse = _is_shared(X) and np.issubdtype(X.dtype, np.floating) and X.flags.writeable \
+            and (not self.copy_X or not self.scaling)
+        if comm.allreduce(reuse, op=MPI.LAND):
+            window = None
         else:
-            start = (rank * int((self.n_subsets/number_of_workers))) + (self.n_subsets % number_of_workers)
-            stop = start + int((self.n_subsets/number_of_workers)) - 1
-        my_chunk_len = stop-start+1
-        if Xval is None:
-            predicts = np.zeros((len(X),my_chunk_len))
-            dists = np.zeros((len(X),my_chunk_len))
+            # Only the first rank of each node copies and scales the data,
+            # which is stored as floats so that it can be scaled in place
+            X = np.asarray(X)
+            X, window = _shared_window(X if np.issubdtype(X.dtype, np.floating) else X.astype(float))
+        if (self.scaling):
+            mean, scale = self._fit_scaler(X)
+            if get_node_comm().Get_rank() == 0:
+                X -= mean
+                X /= scale
+        get_node_comm().Barrier()
+        return X, window
+
+    def _fit_scaler(self, X: np.array):
+        '''
+        Fits the scaling object on X, which is held by all ranks: each rank
+        computes the statistics of a block of rows, which are reduced with Allreduce.
+        Returns the mean and the scale of the features.
+        '''
+
+        len_X = len(X)
+        return self._fit_scaler_shards(X[rank*len_X//number_of_workers:(rank+1)*len_X//number_of_workers])
+
+    def _scale_sharded_data(self, X_local: np.array):
+        '''
+        Fits the scaling object on the union of the shards of all ranks
+        and returns the scaled local shard
+        '''
+
+        if not self.scaling:
+            return X_local
+        mean, scale = self._fit_scaler_shards(X_local)
+        # Applied directly, since StandardScaler.transform rejects empty shards
+        return (X_local - mean) / scale
+
+    def _fit_scaler_shards(self, X_local: np.array):
+        '''
+        Fits the scaling object on the union of the rows X_local of all ranks
+        (two passes with Allreduce). Returns the mean and the scale of the features.
+        '''
+
+        if self._warm():
+            # The scaling of the previous fit is kept
+            return self._scobject.mean_, self._scobject.scale_
+        len_X = comm.allreduce(len(X_local), op=MPI.SUM)
+        mean = np.sum(X_local, axis=0)
+        comm.Allreduce(MPI.IN_PLACE, mean, op=MPI.SUM)
+        mean /= len_X
+        var = np.sum((X_local - mean)**2, axis=0)
+        comm.Allreduce(MPI.IN_PLACE, var, op=MPI.SUM)
+        var /= len_X
+        self._scobject = StandardScaler()
+        self._scobject.mean_ = mean
+        self._scobject.var_ = var
+        # Constant features are not scaled (as in StandardScaler)
+        scale = np.sqrt(var)
+        scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0
+        self._scobject.scale_ = scale
+        self._scobject.n_samples_seen_ = len_X
+        self._scobject.n_features_in_ = X_local.shape[1]
+        return mean, scale
+
+    def _share_replications(self):
+        '''
+        Sends the fitted replications from rank 0 to all ranks so that
+        every rank can take part in the prediction (parallel_predict)
+        '''
+
+        if self.parallel_predict:
+            # Only the replications of this fit are sent (warm_start)
+            first = self._first_replication
+            replications = None
+            if rank == 0:
+                replications = self._replications[first:]
+                self._communicated_object('share_replications', replications)
+            with self._phase('share_replications'):
+                replications = comm.bcast(replications, root=0)
+            self._replications = self._replications[:first] + replications
+
+    def _compile_replications(self):
+        '''
+        Stacks the centers (and the coefficients of linear local estimators)
+        of every replication held by this rank into dense matrices, so that
+        predict needs a single matrix product per replication
+        '''
+
+        first = self._first_replication
+        self._compiled = self._compiled[:first] + [self._compile_local_models(replication.local_estimators)
+                                                   for replication in self._replications[first:]]
+        if first == 0:
+            self._center_trees = None
+
+    def _compile_local_models(self, local_models: List[LocalModelR]):
+        '''
+        Returns the centers (and the coefficients of linear local estimators)
+        of the local models stacked into dense matrices
+        '''
+
+        centers = np.array([local_model.center for local_model in local_models], dtype=float)
+        parameters = [_linear_parameters(local_model.estimator) for local_model in local_models]
+        if any(parameter is None for parameter in parameters):
+            return CompiledReplicationR(centers, None, None)
+        coefs = np.array([coef for coef, _ in parameters])
+        intercepts = np.array([intercept for _, intercept in parameters])
+        return CompiledReplicationR(centers, coefs, intercepts)
+
+    def _distances(self, data: np.array, centers: np.array, n_subsets: int):
+        '''
+        Returns the distances from the samples in data to the given local centers,
+        where n_subsets is the total number of subsets of the replication
+        '''
+
+        if self.distance_function is None:
+            return rbf_batch(data, centers, coeff=1.0/np.power(n_subsets, 2.0),
+                             block_size=self.distance_block_size)
+        if getattr(self.distance_function, 'batched', False):
+            return self.distance_function(data, centers)
+        dists = np.zeros((len(data), len(centers)))
+        for j, center in enumerate(centers):
+            dists[:, j] = self.distance_function(data, center)
+        return dists
+
+    def _replication_indices(self):
+        '''
+        Returns the indices of the replications evaluated by this rank.
+        The replications are distributed cyclically over the ranks
+        when parallel_predict is set.
+        '''
+
+        if self.parallel_predict:
+            return range(rank, self.n_replications, number_of_workers)
+        return range(self.n_replications)
+
+    def _reduce_predictions(self, yhat: np.array):
+        '''
+        Sums the partial predictions of all ranks (parallel_predict)
+        '''
+
+        if self.parallel_predict:
+            self._communicated('reduce_predictions', yhat)
+            with self._phase('reduce_predictions'):
+                comm.Allreduce(MPI.IN_PLACE, yhat, op=MPI.SUM)
+        return yhat
+
+    def _mean_proba(self, X0: np.array, labels: np.array, vote: Callable[[np.array], np.array]):
+        '''
+        Returns the class probabilities for X0 averaged over the replications, where
+        labels are the targets of the global estimators in the order of the classes.
+        The predict_proba outputs of the global estimators are used; a global estimator
+        without predict_proba gives a vote to the class it predicts (to the nearest label
+        if its prediction is continuous, e.g., a global regressor), and vote(features)
+        returns the indices of the classes voted for when there is no global estimator.
+        '''
+
+        len_X0: int = len(X0)
+        proba = np.zeros((len_X0, len(labels)))
+        for i in self._replication_indices():
+            global_model = self._replications[i].global_estimator
+            features = self._replication_features(X0, i)
+
+            if hasattr(global_model, 'predict_proba'):
+                # Only the classes seen by the global estimator have columns
+                proba[:, np.searchsorted(labels, global_model.classes_)] += global_model.predict_proba(features)
+            elif global_model is not None:
+                predictions = global_model.predict(features)
+                # Index of the nearest label (the upper one on ties, as in vote)
+                upper = np.clip(np.searchsorted(labels, predictions), 1, len(labels) - 1)
+                nearest = np.where(predictions - labels[upper - 1] < labels[upper] - predictions, upper - 1, upper)
+                proba[np.arange(len_X0), nearest] += 1
+            else:
+                proba[np.arange(len_X0), vote(features)] += 1
+
+        # Each rank adds only the probabilities of its own replications
+        return self._reduce_predictions(proba) / self.n_replications
+
+    def _replication_features(self, X0: np.array, i: int):
+        '''
+        Returns the input of the global estimator of the i-th replication,
+        i.e., the normalized distances times the local predictions for X0
+        '''
+
+        with self._phase('predict_features', i):
+            if self.n_nearest_subsets is not None:
+                return self._sparse_features(X0, self._replications[i].local_estimators,
+                                             self._compiled[i], self._center_tree(i))
+            return self._features(X0, self._replications[i].local_estimators, self._compiled[i])
+
+    def _features(self, X0: np.array, local_models: List[LocalModelR], compiled: CompiledReplicationR):
+        '''
+        Returns the normalized distances times the local predictions for X0,
+        given the local models and their compiled form
+        '''
+
+        n_subsets = len(local_models)
+        if compiled.coefs is not None:
+            # Multi-output coefficients are flattened to one row per (subset, output)
+            predicts = X0 @ compiled.coefs.reshape(-1, X0.shape[1]).T + compiled.intercepts.ravel()
         else:
-            predicts = np.zeros((len(Xval),my_chunk_len))
-            dists = np.zeros((len(Xval),my_chunk_len))
-            
+            predicts = np.column_stack(self._map(lambda local_model: local_model.estimator.predict(X0),
+                                                 local_models))
 
-        local_models: List[LocalModelR] = [None for i in range(my_chunk_len)]
-        
-        for job_index in range(start,stop+1):
-            neighbor_i = job_index
-            neighbor_indices = neighbor_indices_list[job_index]
-            Xneighbors, yneighbors = X[neighbor_indices], y[neighbor_indices]
+        dists = self._distances(X0, compiled.centers, n_subsets)
+
+        # Normalize the distances from samples to the local subsets
+        if self.d_normalize:
+            denom = np.sum(dists, axis=1)
+            denom[denom < 1.0e-8] = 1.0e-8
+            dists = (dists.T/denom).T
+
+        # Multi-output local models have a column for each (subset, output) pair
+        n_outputs = predicts.shape[1] // n_subsets
+        if n_outputs > 1:
+            dists = np.repeat(dists, n_outputs, axis=1)
+
+        return dists * predicts
+
+    def _chunks(self, X0, stream: bool = False):
+        '''
+        Returns the chunks of the test samples: X0 is a 2-D array-like (e.g., a
+        np.memmap or a list of rows), which is sliced into chunks of batch_size rows,
+        or, if stream is set (predict_iter), an iterator (e.g., a generator) of 2-D chunks.
+        With parallel_predict, all ranks must pass the same chunks.
+        '''
+
+        if stream and isinstance(X0, collections.abc.Iterator):
+            return X0
+        if not hasattr(X0, 'ndim'):
+            X0 = np.asarray(X0)
+        if self.batch_size is None:
+            return [X0]
+        return (X0[start:start+self.batch_size] for start in range(0, len(X0), self.batch_size))
+
+    def predict_iter(self, X0):
+        '''
+        Generator of the predictions for the test samples in X0, chunk by chunk,
+        where X0 is a 2-D array read batch_size rows at a time (e.g., a np.memmap)
+        or an iterator (e.g., a generator) of 2-D chunks. The memory used for the
+        predictions is bounded by the chunk size instead of the number of test samples.
+        '''
+
+        check_is_fitted(self, attributes='_isfitted')
+        for X0_chunk in self._chunks(X0, stream=True):
+            yield self._predict_chunk(X0_chunk)
+
+    def _nearest_subsets(self, X0: np.array, centers: np.array, tree=None):
+        '''
+        Returns the indices of the n_nearest_subsets nearest centers of the samples in X0
+        and the (normalized) distances to them, using the tree over the centers if given
+        '''
+
+        n_subsets = len(centers)
+        k = min(self.n_nearest_subsets, n_subsets)
+        if tree is None:
+            tree = KDTree(centers)
+        dists, nearest = tree.query(X0, k=k)
+        if self.distance_function is None:
+            # RBF of the Euclidean distances (as rbf_batch)
+            weights = np.exp(-dists/np.power(n_subsets, 2.0))
+        else:
+            weights = np.zeros(nearest.shape)
+            for s, positions in enumerate(_inverted_index(nearest, n_subsets)):
+                rows, cols = np.divmod(positions, k)
+                weights[rows, cols] = self._distances(X0[rows], centers[[s]], n_subsets)[:, 0]
+
+        if self.d_normalize:
+            denom = np.sum(weights, axis=1)
+            denom[denom < 1.0e-8] = 1.0e-8
+            weights = (weights.T/denom).T
+        return nearest, weights
+
+    def _sparse_features(self, X0: np.array, local_models: List[LocalModelR],
+                         compiled: CompiledReplicationR, tree=None):
+        '''
+        Returns the sparse (CSR) input of the global estimator for X0 (n_nearest_subsets),
+        where only the local models of the nearest centers of each sample are evaluated
+        '''
+
+        n_subsets = len(local_models)
+        nearest, weights = self._nearest_subsets(X0, compiled.centers, tree)
+        len_X0, k = nearest.shape
+        if compiled.coefs is not None:
+            predicts = np.einsum('ij,ikj->ik', X0, compiled.coefs[nearest]) + compiled.intercepts[nearest]
+        else:
+            predicts = np.zeros(nearest.shape)
+            for s, positions in enumerate(_inverted_index(nearest, n_subsets)):
+                if len(positions) > 0:
+                    rows, cols = np.divmod(positions, k)
+                    predicts[rows, cols] = local_models[s].estimator.predict(X0[rows])
+        return csr_matrix(((weights * predicts).ravel(), nearest.ravel(), np.arange(0, len_X0*k+1, k)),
+                          shape=(len_X0, n_subsets))
+
+    def _center_tree(self, i: int):
+        '''
+        Returns the tree over the local centers of the i-th replication (built once)
+        '''
+
+        if getattr(self, '_center_trees', None) is None:
+            self._center_trees = {}
+        if i not in self._center_trees:
+            self._center_trees[i] = KDTree(self._compiled[i].centers)
+        return self._center_trees[i]
+
+    def _assigned_jobs(self, n_jobs: int, worker: int = rank):
+        '''
+        Returns the indices of the jobs assigned to a rank (this rank by default),
+        i.e., a contiguous block of almost equal size
+        '''
+
+        if worker < (n_jobs % number_of_workers):
+            start = worker * (int((n_jobs/number_of_workers))+1)
+            stop = start + int((n_jobs/number_of_workers))
+        else:
+            start = (worker * int((n_jobs/number_of_workers))) + (n_jobs % number_of_workers)
+            stop = start + int((n_jobs/number_of_workers)) - 1
+        return range(start, stop+1)
+
+    def _balanced_jobs(self, costs: list):
+        '''
+        Returns the indices of the jobs assigned to this rank. Jobs of equal cost
+        are assigned in contiguous blocks, otherwise each job is assigned (in the
+        order of decreasing cost) to the rank with the least total cost so far.
+        '''
+
+        costs = np.asarray(costs)
+        if len(costs) == 0 or np.all(costs == costs[0]):
+            return self._assigned_jobs(len(costs))
+        loads = np.zeros(number_of_workers)
+        jobs = []
+        for job_index in np.argsort(-costs, kind='stable'):
+            worker = int(np.argmin(loads))
+            loads[worker] += costs[job_index]
+            if worker == rank:
+                jobs.append(job_index)
+        return sorted(jobs)
+
+    def _dynamic_jobs(self, costs: np.array, run_job: Callable[[int], tuple]):
+        '''
+        Master/worker scheduling: the jobs are handed out on request (n_threads
+        at a time) in the order of decreasing cost until the queue is empty. Rank 0
+        serves the requests and runs the cheapest remaining jobs while no request is pending.
+        Returns the outputs of the jobs run by this rank. The jobs must not depend on
+        the rank running them (see _local_seed), since the assignment changes from run to run.
+        '''
+
+        order = np.argsort(-np.asarray(costs), kind='stable')
+        if number_of_workers == 1:
+            return self._map(run_job, order)
+
+        # The jobs are handed out (and run by rank 0) n_threads at a time,
+        # so that each batch runs on the thread pool of the rank
+        outputs = []
+        if rank == 0:
+            head, tail = 0, len(order)
+            n_stopped = 0
+            while n_stopped < number_of_workers - 1:
+                if head < tail and not comm.Iprobe(source=MPI.ANY_SOURCE, tag=_TAG_JOB_REQUEST):
+                    batch = order[max(head, tail - self.n_threads):tail]
+                    tail -= len(batch)
+                    outputs.extend(self._map(run_job, batch))
+                    continue
+                worker = comm.recv(source=MPI.ANY_SOURCE, tag=_TAG_JOB_REQUEST)
+                batch = order[head:min(tail, head + self.n_threads)]
+                head += len(batch)
+                # An empty batch stops the worker
+                comm.send([int(job_index) for job_index in batch], dest=worker, tag=_TAG_JOB_ASSIGN)
+                if len(batch) == 0:
+                    n_stopped += 1
+        else:
+            while True:
+                comm.send(rank, dest=0, tag=_TAG_JOB_REQUEST)
+                batch = comm.recv(source=0, tag=_TAG_JOB_ASSIGN)
+                if len(batch) == 0:
+                    break
+                outputs.extend(self._map(run_job, batch))
+        return outputs
+
+    def _replication_rounds(self):
+        '''
+        Returns the replications that are fitted together in each round
+        (starting from the first replication that is not fitted yet).
+        With parallel_mode 'subsets', the rounds are the replications one by one,
+        whereas with 'replications', all replications are fitted in a single round.
+        '''
+
+        first = self._first_replication
+        if first == self.n_replications:
+            return []
+        if self.parallel_mode == 'replications':
+            return [range(first, self.n_replications)]
+        return [range(i, i+1) for i in range(first, self.n_replications)]
+
+    def _local_seed(self, i: int, s: int):
+        '''
+        Returns the seed of the local estimator of the s-th subset of the i-th replication.
+        It is derived from the base seed broadcast by rank 0 (see _prepare_fit), so that
+        the local estimators do not depend on the rank, the thread or the order fitting them.
+        '''
+
+        return np.random.default_rng([self._seed_base, i, s]).integers(np.iinfo(np.int16).max)
+
+    def _replication_rng(self, i: int, stream: int):
+        '''
+        Returns the random generator of a stream (_STREAM_SPLIT, _STREAM_ANCHORS, _STREAM_CLUSTER
+        or _STREAM_GLOBAL) of the i-th replication. It is derived from the base seed broadcast
+        by rank 0, so that all ranks draw the same numbers without communication, and a replication
+        does not depend on the rounds (parallel_mode) or the fits (warm_start) fitting it.
+        '''
+
+        return np.random.default_rng(np.random.SeedSequence(self._seed_base, spawn_key=(i, stream)))
+
+    def _fit_local(self, Xneighbors: np.array, yneighbors: np.array, seed: int):
+        '''
+        Trains a local estimator on the samples of a subset
+        (with the given seed if the estimator is random)
+        '''
+
+        if ('random_state' in self.local_estimator().get_params().keys()):
+            return self.local_estimator().set_params(random_state=seed).fit(Xneighbors, yneighbors)
+        return self.local_estimator().fit(Xneighbors, yneighbors)
+
+    def _fit_subset(self, X, y, subsets, centers, r, s, seed):
+        '''
+        Trains the local estimator of the s-th subset of the r-th replication
+        (see _fit_helper) with the given seed and returns it with its center
+        '''
+
+        neighbor_indices = subsets[r][s]
+        Xneighbors, yneighbors = X[neighbor_indices], y[neighbor_indices]
+        if centers is None or centers[r] is None:
             local_center = np.mean(Xneighbors, axis=0)
-            if ('random_state' in self.local_estimator().get_params().keys()):
-                local_model = self.local_estimator().\
-                    set_params(random_state=self.rng_.integers(np.iinfo(np.int16).max)).\
-                        fit(Xneighbors, yneighbors)
-            else:
-                local_model = self.local_estimator().fit(Xneighbors, yneighbors)
-            local_models[job_index - start] = (LocalModelR(estimator=local_model, center=local_center))
-            if Xval is None:
-                predicts[:, job_index - start] = local_model.predict(X)
-            else:
-                predicts[:, job_index - start] = local_model.predict(Xval)
-                
-            if(self.distance_function == None):
-                if(Xval is None):
-                    dists[:, job_index - start] = rbf(X, local_center, \
-                        coeff=1.0/np.power(self.n_subsets, 2.0))
-                else:
-                    dists[:, job_index - start] = rbf(Xval, local_center, \
-                        coeff=1.0/np.power(self.n_subsets, 2.0))
+        else:
+            local_center = centers[r][s]
+        return self._local_model(Xneighbors, yneighbors, local_center, seed)
+
+    def _local_model(self, Xneighbors: np.array, yneighbors: np.array, local_center: np.array, seed: int):
+        '''
+        Trains a local estimator and returns it with its center
+        (and the sufficient statistics of its subset if online is set)
+        '''
+
+        stats = None
+        if self.online:
+            Z = np.column_stack((np.ones(len(Xneighbors)), Xneighbors))
+            stats = (Z.T @ Z, Z.T @ yneighbors)
+        return LocalModelR(estimator=self._fit_local(Xneighbors, yneighbors, seed), center=local_center,
+                           stats=stats)
+
+    def _run_jobs(self, subsets, run_job):
+        '''
+        Runs the jobs, i.e., the (replication, subset) pairs numbered consecutively,
+        with the selected scheduler and returns the outputs of the jobs of this rank
+        '''
+
+        # The cost of a job is estimated by the size of its subset
+        costs = [len(subsets[r][s]) for r in range(len(subsets)) for s in range(len(subsets[r]))]
+        if self.scheduler == 'dynamic':
+            return self._dynamic_jobs(costs, run_job)
+        return self._map(run_job, self._balanced_jobs(costs))
+
+    def _map(self, function: Callable, items):
+        '''
+        Returns the outputs of function for the items (in order),
+        evaluated in a pool of n_threads threads if n_threads > 1
+        '''
+
+        if self.n_threads == 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            return list(executor.map(function, items))
+
+    def _fit_helper_sparse(self, X, y, subsets, eval_indices=None, centers=None):
+        '''
+        Variant of _fit_helper for n_nearest_subsets: the local estimators are trained
+        first, and then each rank evaluates its local models only on the samples that
+        have them among their nearest centers. The centers (and hence the weights) are
+        known on all ranks, so only the nonzero features are gathered on rank 0.
+        Returns [features, local_models] of each replication on rank 0, where features
+        is a sparse (CSR) matrix.
+        '''
+
+        n_reps = len(subsets)
+        offsets = np.cumsum([0] + [len(subsets[r]) for r in range(n_reps)])
+        first = self._next_replication
+        self._next_replication += n_reps
+
+        def run_job(job_index):
+            r = np.searchsorted(offsets, job_index, side='right') - 1
+            s = job_index - offsets[r]
+            with self._phase('local_fit', first + r):
+                return r, s, self._fit_subset(X, y, subsets, centers, r, s, self._local_seed(first + r, s))
+
+        outputs = sorted(self._run_jobs(subsets, run_job), key=lambda output: output[:2])
+        # All ranks need the centers of all local models
+        subset_centers = [np.zeros((len(subsets[r]), X.shape[1])) for r in range(n_reps)]
+        sent = [(r, s, local_model.center) for r, s, local_model in outputs]
+        self._communicated_object('centers_comm', sent)
+        for outputs_gathered in comm.allgather(sent):
+            for r, s, center in outputs_gathered:
+                subset_centers[r][s] = center
+
+        # Nearest centers and weights of the evaluation samples, and their
+        # positions (in the nearest array) for each local model
+        Xevals, nearest, weights, positions = {}, {}, {}, {}
+        for r in range(n_reps):
+            Xevals[r] = X if eval_indices is None else X[eval_indices[r]]
+            nearest[r], weights[r] = self._nearest_subsets(Xevals[r], subset_centers[r])
+            positions[r] = _inverted_index(nearest[r], len(subsets[r]))
+
+        sendbuf = [np.zeros(0)]
+        for r, s, local_model in outputs:
+            rows, cols = np.divmod(positions[r][s], nearest[r].shape[1])
+            if len(rows) > 0:
+                sendbuf.append(weights[r][rows, cols] * local_model.estimator.predict(Xevals[r][rows]))
+        sendbuf = np.concatenate(sendbuf)
+        self._communicated('features_comm', sendbuf)
+        sent = [(r, s, local_model) for r, s, local_model in outputs]
+        self._communicated_object('local_models_comm', sent)
+        with self._phase('features_comm'):
+            outputs_gathered = comm.gather(sent, root=0)
+            if rank != 0:
+                comm.Gatherv(sendbuf, None, root=0)
+                return [None for r in range(n_reps)]
+
+            counts = [sum(len(positions[r][s]) for r, s, _ in outputs) for outputs in outputs_gathered]
+            recvbuf = np.empty(sum(counts))
+            comm.Gatherv(sendbuf, [recvbuf, counts, np.cumsum([0] + counts[:-1]), MPI.DOUBLE], root=0)
+
+        data = [np.zeros(nearest[r].size) for r in range(n_reps)]
+        fitted = [[None, [None for s in range(len(subsets[r]))]] for r in range(n_reps)]
+        position = 0
+        for outputs in outputs_gathered:
+            for r, s, local_model in outputs:
+                count = len(positions[r][s])
+                data[r][positions[r][s]] = recvbuf[position:position+count]
+                position += count
+                fitted[r][1][s] = local_model
+        for r in range(n_reps):
+            len_Xeval, k = nearest[r].shape
+            fitted[r][0] = csr_matrix((data[r], nearest[r].ravel(), np.arange(0, len_Xeval*k+1, k)),
+                                      shape=(len_Xeval, len(subsets[r])))
+        return fitted
+
+    def _fit_helper(self, X, y, subsets, eval_indices=None, centers=None):
+        '''
+        Trains the local estimators of one or more replications in parallel.
+        subsets[r][s] holds the indices of the samples (rows of X) in the s-th subset
+        of the r-th replication. The local estimators are evaluated on X, or on the
+        samples X[eval_indices[r]] when validation is used. The centers of the subsets
+        are the means of their samples, unless centers[r] is given (cluster centers).
+        Returns [features, local_models] of each replication on rank 0, where features
+        is the input of the global estimator (normalized distances times predictions).
+        If y has several columns (outputs), the local estimators are multi-output and
+        features has a column for each (subset, output) pair.
+        '''
+
+        if self.n_nearest_subsets is not None:
+            return self._fit_helper_sparse(X, y, subsets, eval_indices, centers)
+
+        n_reps = len(subsets)
+        n_outputs = 1 if y.ndim == 1 else y.shape[1]
+        # The (replication, subset) pairs are numbered consecutively
+        offsets = np.cumsum([0] + [len(subsets[r]) for r in range(n_reps)])
+        # Evaluation samples of the replications (sliced once per rank)
+        Xevals = {}
+        first = self._next_replication
+        self._next_replication += n_reps
+
+        def run_job(job_index):
+            r = np.searchsorted(offsets, job_index, side='right') - 1
+            s = job_index - offsets[r]
+            if r not in Xevals:
+                Xevals[r] = X if eval_indices is None else X[eval_indices[r]]
+            with self._phase('local_fit', first + r):
+                local_model = self._fit_subset(X, y, subsets, centers, r, s, self._local_seed(first + r, s))
+                return r, s, local_model, local_model.estimator.predict(Xevals[r])
+
+        outputs = self._run_jobs(subsets, run_job)
+
+        rep_outputs = {}
+        for r, s, local_model, predict in outputs:
+            rep_outputs.setdefault(r, []).append((s, local_model, predict))
+        results = []
+        for r in sorted(rep_outputs):
+            subset_indices = [s for s, _, _ in rep_outputs[r]]
+            local_models: List[LocalModelR] = [local_model for _, local_model, _ in rep_outputs[r]]
+            predicts = np.column_stack([predict for _, _, predict in rep_outputs[r]])
+            # Distances to all local centers of this rank are evaluated at once
+            local_centers = np.array([local_model.center for local_model in local_models])
+            dists = self._distances(Xevals[r], local_centers, len(subsets[r]))
+            results.append([r, subset_indices, predicts, dists, local_models])
+
+        len_Xevals = [len(X) if eval_indices is None else len(eval_indices[r]) for r in range(n_reps)]
+        eval_offsets = np.cumsum([0] + len_Xevals)
+        # Normalize the distances from samples to the local subsets:
+        # the row sums of all replications are reduced at once
+        if self.d_normalize:
+            denom = np.zeros(eval_offsets[-1])
+            for r, _, _, dists, _ in results:
+                denom[eval_offsets[r]:eval_offsets[r+1]] += np.sum(dists, axis=1)
+            self._communicated('normalize_comm', denom)
+            with self._phase('normalize_comm'):
+                comm.Allreduce(MPI.IN_PLACE, denom, op=MPI.SUM)
+            denom[denom < 1.0e-8] = 1.0e-8
+            for result in results:
+                r = result[0]
+                result[3] = (result[3].T/denom[eval_offsets[r]:eval_offsets[r+1]]).T
+
+        # Only the features (columns of this rank) are sent to rank 0
+        sendbuf = np.concatenate([(np.repeat(dists, n_outputs, axis=1) * predicts).T.ravel()
+                                  for _, _, predicts, dists, _ in results] + [np.zeros(0)])
+        self._communicated('features_comm', sendbuf)
+        sent = [(r, subset_indices, local_models) for r, subset_indices, _, _, local_models in results]
+        self._communicated_object('local_models_comm', sent)
+        with self._phase('features_comm'):
+            results_gathered = comm.gather(sent, root=0)
+            if rank != 0:
+                comm.Gatherv(sendbuf, None, root=0)
+                return [None for r in range(n_reps)]
+
+            counts = [sum(len(subset_indices)*n_outputs*len_Xevals[r] for r, subset_indices, _ in results)
+                      for results in results_gathered]
+            recvbuf = np.empty(sum(counts))
+            comm.Gatherv(sendbuf, [recvbuf, counts, np.cumsum([0] + counts[:-1]), MPI.DOUBLE], root=0)
+
+        fitted = []
+        for r in range(n_reps):
+            fitted.append([np.zeros((len_Xevals[r], len(subsets[r])*n_outputs)),
+                           [None for s in range(len(subsets[r]))]])
+        position = 0
+        for results in results_gathered:
+            for r, subset_indices, local_models in results:
+                # Columns of the (subset, output) pairs
+                columns = (np.array(subset_indices, dtype=int)[:, None]*n_outputs + np.arange(n_outputs)).ravel()
+                count = len(columns)*len_Xevals[r]
+                fitted[r][0][:, columns] = recvbuf[position:position+count].\
+                    reshape(len(columns), len_Xevals[r]).T
+                position += count
+                for s, local_model in zip(subset_indices, local_models):
+                    fitted[r][1][s] = local_model
+        return fitted
+
+    def _fit_global(self, features: np.array, y: np.array, i: int):
+        '''
+        Trains the global estimator of the i-th replication on the features
+        returned by _fit_helper (called only on rank 0)
+        '''
+
+        if y.ndim > 1:
+            # One output per class (native multiclass): the global
+            # estimator is trained on the class indices
+            y = np.argmax(y, axis=1)
+        if self.global_estimator is not None:
+            with self._phase('global_fit', i):
+                if 'random_state' in self.global_estimator().get_params().keys():
+                    seed = self._replication_rng(i, _STREAM_GLOBAL).integers(np.iinfo(np.int16).max)
+                    return self.global_estimator().set_params(random_state=seed).fit(features, y)
+                return self.global_estimator().fit(features, y)
+        return None
+
+    def _tree(self, X_train: np.array, key):
+        '''
+        Returns the nearest neighbor tree of a training set. The tree of the
+        last training set (identified by key) is kept and reused.
+        '''
+
+        if self._tree_cache is None or self._tree_cache[0] != key:
+            # Release the previous tree before growing the new one
+            self._tree_cache = None
+            with self._phase('tree'):
+                self._tree_cache = (key, self.tree_method(X_train, self.n_subsets))
+        return self._tree_cache[1]
+
+    def _neighbor_indices(self, X: np.array, replications: range, splits: list):
+        '''
+        Selects n_subsets many samples for each replication of a round and returns
+        (on all ranks) the indices of their nearest neighbors as rows of X.
+        splits[r] is a pair (key, train_indices) identifying the training set of the
+        r-th replication (train_indices is None if all of X is used). The trees are
+        grown only on the ranks that query them, i.e., rank 0, or all ranks when
+        parallel_query is set, in which case each rank queries a share of the samples.
+        '''
+
+        n_reps = len(splits)
+        sample_indices = np.zeros([n_reps, self.n_subsets], dtype='i')
+        neighbor_indices_list = np.zeros([n_reps, self.n_subsets, self.n_neighbors], dtype='i')
+        for r, (i, (_, train_indices)) in enumerate(zip(replications, splits)):
+            len_X_train = len(X) if train_indices is None else len(train_indices)
+            # Select n_subsets many samples to construct the local sample sets
+            rng = self._replication_rng(i, _STREAM_ANCHORS)
+            sample_indices[r] = rng.choice(len_X_train, size=self.n_subsets)
+
+        if self.parallel_query:
+            queries = self._assigned_jobs(n_reps*self.n_subsets)
+        else:
+            queries = range(n_reps*self.n_subsets) if rank == 0 else range(0)
+
+        # Construct the local sample sets (queries are numbered consecutively)
+        flat_indices_list = neighbor_indices_list.reshape(n_reps*self.n_subsets, self.n_neighbors)
+        for r, (key, train_indices) in enumerate(splits):
+            start = max(queries.start, r*self.n_subsets)
+            stop = min(queries.stop, (r+1)*self.n_subsets)
+            if start >= stop:
+                continue
+            X_train = X if train_indices is None else X[train_indices]
+            queried = sample_indices[r, start-r*self.n_subsets:stop-r*self.n_subsets]
+            tree = self._tree(X_train, key)
+            with self._phase('query'):
+                _, neighbors = tree.query(X_train[queried], k=self.n_neighbors)
+            # Neighbors are mapped back to the rows of X
+            flat_indices_list[start:stop] = neighbors if train_indices is None else train_indices[neighbors]
+
+        self._communicated('neighbors_comm', neighbor_indices_list)
+        with self._phase('neighbors_comm'):
+            if self.parallel_query:
+                counts = [len(self._assigned_jobs(n_reps*self.n_subsets, worker))*self.n_neighbors
+                          for worker in range(number_of_workers)]
+                comm.Allgatherv(MPI.IN_PLACE, [flat_indices_list, counts,
+                                               np.cumsum([0] + counts[:-1]), MPI.INT])
             else:
-                if(Xval is None):
-                    dists[:, job_index - start] = self.distance_function(X, local_center)
-                else:
-                    dists[:, job_index - start] = self.distance_function(Xval, local_center)
-                  
-
-        local_models_gathered = comm.gather(local_models, root=0)
-        dists_gathered = comm.gather(dists, root=0)
-        predicts_gathered = comm.gather(predicts, root=0)
-        if(rank == 0):
-            dists_gathered = (np.concatenate(dists_gathered, axis=1))
-            local_models_gathered = [localmodel for localmodels in local_models_gathered for localmodel in localmodels]
-            predicts_gathered = np.concatenate(predicts_gathered, axis=1)
-        return [predicts_gathered, dists_gathered, local_models_gathered]
+                comm.Bcast(neighbor_indices_list, root=0)
+        return neighbor_indices_list
 
     def _fitnoval(self, X: np.array, y: np.array):
         '''
@@ -277,109 +1613,104 @@ class _LESS(BaseEstimator, SklearnEstimator):
         len_X: int = len(X)
         # Check the validity of the input
         self._check_input(len_X)
-        # A nearest neighbor tree is grown for querying
-        tree = self.tree_method(X, self.n_subsets)
-        self._replications = []
-        for _ in range(self.n_replications):
-            if rank == 0:
-                # Select n_subsets many samples to construct the local sample sets
-                sample_indices = self._rng.choice(len_X, size=self.n_subsets)
-                # Construct the local sample sets
-                _, neighbor_indices_list = np.array(tree.query(X[sample_indices], k=self.n_neighbors), dtype = 'i')
-            else:
-                neighbor_indices_list = np.zeros([self.n_subsets, self.n_neighbors],dtype='i')
-            comm.Bcast(neighbor_indices_list, root=0)
-            local_models: List[LocalModelR] = []
-            dists = np.zeros((len_X, self.n_subsets))
-            predicts = np.zeros((len_X, self.n_subsets))
-            [predicts,dists,local_models] = self._fit_helper(X,y,neighbor_indices_list)
+        # A single nearest neighbor tree is grown for querying
+        self._tree_cache = None
+        for replications in self._replication_rounds():
+            neighbor_indices_list = self._neighbor_indices(X, replications,
+                                                           [(None, None) for _ in replications])
+            fitted = self._fit_helper(X, y, neighbor_indices_list)
             if rank == 0:
-                # Normalize the distances from samples to the local subsets
-                if self.d_normalize:
-                    denom = np.sum(dists, axis=1)
-                    denom[denom < 1.0e-8] = 1.0e-8
-                    dists = (dists.T/denom).T
-            
-                if (self.global_estimator != None):
-                    if ('random_state' in self.global_estimator().get_params().keys()):
-                        global_model = self.global_estimator().\
-                            set_params(random_state=self._rng.integers(np.iinfo(np.int16).max)).\
-                                fit(dists * predicts, y)
-                    else:
-                        global_model = self.global_estimator().fit(dists * predicts, y)
-                else:
-                     global_model = None
-
-                self._replications.append(ReplicationR(global_model, local_models))
+                for i, (features, local_models) in zip(replications, fitted):
+                    global_model = self._fit_global(features, y, i)
+                    self._replications.append(ReplicationR(global_model, local_models))
+        self._tree_cache = None
 
         return self
 
+    def _split_indices(self, len_X: int, seed: int):
+        '''
+        Returns the training and validation indices of a replication.
+        All ranks derive the same split from the broadcast seed.
+        '''
+
+        return train_test_split(np.arange(len_X), test_size=self.val_size, random_state=seed)
+
     def _fitval(self, X: np.array, y: np.array):
         '''
         Fit function: (val_size x data) is used for the global estimator (validation)
         Tree method is used (no clustering)
         '''
 
-        self._replications = []
-        for i in range(self.n_replications):
-            if rank == 0:
-                # Split for global estimation
-                X_train, X_val, y_train, y_val = train_test_split(X, y,
-                    test_size=self.val_size,
-                    random_state=self._rng.integers(np.iinfo(np.int16).max))
-            else:
-                len_x_val = int(len(X) * self.val_size)
-                len_y_val = int(len(y) * self.val_size)
-                len_x_train = int(len(X) * (1-self.val_size))
-                len_y_train = int(len(y) * (1-self.val_size))
-                X_train = np.empty((len_x_train,X[0].shape[0]))
-                y_train = np.empty(len_y_train)
-                X_val = np.empty((len_x_val,X[0].shape[0]))
-                y_val = np.empty(len_y_val)
-
-            X_train = comm.bcast(X_train, root=0)
-            X_val = comm.bcast(X_val, root=0)
-            y_train = comm.bcast(y_train, root=0)
-            y_val = comm.bcast(y_val,root=0)  
-            len_X_val: int = len(X_val)
-            len_X_train: int = len(X_train)
-            # Check the validity of the input
-            if i == 0:
-                self._check_input(len_X_train)
+        len_X: int = len(X)
+        # Size of the training split (as in train_test_split)
+        len_X_train: int = len_X - int(np.ceil(self.val_size * len_X))
+        # Check the validity of the input
+        self._check_input(len_X_train)
+        self._tree_cache = None
+        for replications in self._replication_rounds():
+            # Split for global estimation: every rank draws the same seeds
+            seeds = [self._replication_rng(i, _STREAM_SPLIT).integers(np.iinfo(np.int16).max)
+                     for i in replications]
+            splits = [self._split_indices(len_X, seed) for seed in seeds]
+            # The seed identifies the training set, so a tree is reused if a seed repeats
+            neighbor_indices_list = self._neighbor_indices(X, replications, [(seed, train_indices)
+                for seed, (train_indices, _) in zip(seeds, splits)])
+            val_indices_list = [val_indices for _, val_indices in splits]
+            fitted = self._fit_helper(X, y, neighbor_indices_list, val_indices_list)
             if rank == 0:
-                # A nearest neighbor tree is grown for querying
-                tree = self.tree_method(X_train, self.n_subsets)
+                for i, (features, local_models), val_indices in zip(replications, fitted, val_indices_list):
+                    global_model = self._fit_global(features, y[val_indices], i)
+                    self._replications.append(ReplicationR(global_model, local_models))
+        self._tree_cache = None
+        return self
 
-                # Select n_subsets many samples to construct the local sample sets
-                sample_indices = self._rng.choice(len_X_train, size=self.n_subsets)
-                # Construct the local sample sets
-                _, neighbor_indices_list = np.array(tree.query(X_train[sample_indices], k=self.n_neighbors), dtype='i')
-            else:
-                neighbor_indices_list = np.zeros([self.n_subsets, self.n_neighbors], dtype = 'i')
-            comm.Bcast(neighbor_indices_list, root=0)
-            local_models: List[LocalModelR] = []
-            dists = np.zeros((len_X_val, self.n_subsets))
-            predicts = np.zeros((len_X_val, self.n_subsets))
-            [predicts,dists,local_models] = self._fit_helper(X_train,y_train,neighbor_indices_list,X_val)
-            if rank == 0:
-                # Normalize the distances from samples to the local subsets
-                if self.d_normalize:
-                    denom = np.sum(dists, axis=1)
-                    denom[denom < 1.0e-8] = 1.0e-8
-                    dists = (dists.T/denom).T
-
-                if self.global_estimator is not None:
-                    if 'random_state' in self.global_estimator().get_params().keys():
-                        global_model = self.global_estimator().\
-                            set_params(random_state=self._rng.integers(np.iinfo(np.int16).max)).\
-                                fit(dists * predicts, y_val)
-                    else:
-                        global_model = self.global_estimator().fit(dists * predicts, y_val)
-                else:
-                    global_model = None
+    def _cluster(self, X: np.array, i: int):
+        '''
+        Clusters the samples in X (for the i-th replication) on rank 0 (or on all ranks for the distributed
+        methods such as MPIKMeans) and returns, on all ranks, the indices of the
+        samples in each cluster and the cluster centers (None if the clustering
+        method does not provide them)
+        '''
+
+        with self._phase('cluster'):
+            return self._cluster_subsets(X, i)
+
+    def _cluster_subsets(self, X: np.array, i: int):
+        '''
+        Clustering of _cluster (timed as a phase)
+        '''
 
-                self._replications.append(ReplicationR(global_model, local_models))
-        return self
+        labels = np.zeros(len(X), dtype='i')
+        cluster_centers = None
+        cluster_method = self.cluster_method()
+        collective = getattr(cluster_method, '_mpi_collective', False)
+        if 'random_state' in cluster_method.get_params().keys():
+            seed = self._replication_rng(i, _STREAM_CLUSTER).integers(np.iinfo(np.int16).max)
+            cluster_method.set_params(random_state=seed)
+        if collective:
+            cluster_fit = cluster_method.fit(X)
+            labels[:] = cluster_fit.labels_
+            cluster_centers = getattr(cluster_fit, 'cluster_centers_', None)
+        else:
+            if rank == 0:
+                cluster_fit = cluster_method.fit(X)
+                labels[:] = cluster_fit.labels_
+                cluster_centers = getattr(cluster_fit, 'cluster_centers_', None)
+                self._communicated('cluster_comm', labels)
+                self._communicated_object('cluster_comm', cluster_centers)
+            comm.Bcast(labels, root=0)
+            cluster_centers = comm.bcast(cluster_centers, root=0)
+
+        # The index lists of all clusters are built at once by sorting the labels
+        # (some clustering methods may find less number of clusters than requested)
+        cluster_labels, inverse = np.unique(labels, return_inverse=True)
+        subsets = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse))[:-1])
+        if cluster_centers is not None and cluster_labels[0] >= 0 \
+            and cluster_labels[-1] < len(cluster_centers):
+            cluster_centers = np.asarray(cluster_centers, dtype=float)[cluster_labels]
+        else:
+            cluster_centers = None
+        return subsets, cluster_centers
 
     def _fitnovalc(self, X: np.array, y: np.array):
         '''
@@ -390,81 +1721,25 @@ class _LESS(BaseEstimator, SklearnEstimator):
         len_X: int = len(X)
         # Check the validity of the input
         self._check_input(len_X)
-        if ('random_state' not in self.cluster_method_().get_params().keys()): 
-                warnings.warn('Clustering method is not random, so there is \
-                    no need for replications, unless validaton set is used. \
-                    Note that lack of replications may increase the variance.') 
-                if(rank == 0):
-                     cluster_fit = self.cluster_method().fit(X)
-                     self.n_replications_ = 1
-                     cluster_fit_labels = cluster_fit.labels_
-                     cluster_fit_centers = cluster_fit.cluster_centers_
-                     n_clusters = cluster_fit_labels.shape[0]
-                     n_features = cluster_fit_labels.shape[1]
-                else:
-                     n_clusters = comm.bcast(n_clusters, root=0)
-                     n_features = comm.bcast(n_features, root=0)
-                     self.n_replications_ = 1
-                     cluster_fit_labels = np.zeros([n_clusters, n_features], dtype = 'i')
-                     cluster_fit_centers = np.zeros([n_clusters, n_features], dtype = 'd')
-                cluster_fit_labels = comm.bcast(cluster_fit_labels, root=0) 
-                cluster_fit_centers = comm.bcast(cluster_fit_centers, root=0) 
-        self.replications_ = []
-        for i in range(self.n_replications_):
-            if (self.n_replications_ > 1):
-                if (rank == 0):
-                    cluster_fit = self.cluster_method(n_jobs=1).\
-                        set_params(random_state=self.rng_.integers(np.iinfo(np.int16).max)).\
-                             fit(X)
-                    cluster_fit_labels = cluster_fit.labels_
-                    cluster_fit_centers = cluster_fit.cluster_centers_
-                    n_clusters = cluster_fit_centers.shape[0]
-                    n_features = cluster_fit_centers.shape[1]
-                else:
-                     n_clusters = 0
-                     n_features = 0
-                     use_cluster_centers = False
-                     cluster_fit_labels = np.zeros([n_clusters, n_features], dtype = 'i')
-                     cluster_fit_centers = np.zeros([n_clusters, n_features], dtype = 'd')
-                    
-                n_clusters = comm.bcast(n_clusters, root=0)
-                n_features = comm.bcast(n_features, root=0)
-                cluster_fit_labels = comm.bcast(cluster_fit_labels, root=0) 
-                cluster_fit_centers = comm.bcast(cluster_fit_centers, root=0) 
-            # Some clustering methods may find less number of
-            # clusters than requested 'n_clusters'
-            self.n_subsets_.append(len(np.unique(cluster_fit_labels)))
-            n_subsets = self.n_subsets_[i]
-            
-            local_models: List[LocalModelR] = []
-            dists = np.zeros((len_X, n_subsets))            
-            predicts = np.zeros((len_X, n_subsets))
-            if rank == 0:            
-                if (hasattr(cluster_fit, 'cluster_centers_')):
-                     use_cluster_centers = True
-                else:
-                     use_cluster_centers = False
-            use_cluster_centers = comm.bcast(use_cluster_centers, root=0)
-            [predicts,dists,local_models] = self._fit_helperc(X,y,cluster_fit_labels,cluster_fit_centers,use_cluster_centers,i)
-
+        if ('random_state' not in self.cluster_method().get_params().keys()):
+            _LESSwarn('''
+                     Clustering method is not random, so there is
+                     no need for replications, unless validaton set is used.
+                     Note that lack of replications may increase the variance.
+                     ''', self.warnings)
+            self.n_replications = 1
+        for replications in self._replication_rounds():
+            subsets, centers = [], []
+            for i in replications:
+                cluster_subsets, cluster_centers = self._cluster(X, i)
+                subsets.append(cluster_subsets)
+                centers.append(cluster_centers)
+                self.n_subsets.append(len(cluster_subsets))
+            fitted = self._fit_helper(X, y, subsets, centers=centers)
             if rank == 0:
-                # Normalize the distances from samples to the local subsets
-                if self.d_normalize:
-                    denom = np.sum(dists, axis=1)
-                    denom[denom < 1.0e-8] = 1.0e-8
-                    dists = (dists.T/denom).T
-
-                if self.global_estimator is not None:
-                    if 'random_state' in self.global_estimator().get_params().keys():
-                        global_model = self.global_estimator().\
-                            set_params(random_state=self._rng.integers(np.iinfo(np.int16).max)).\
-                            fit(dists * predicts, y)
-                    else:
-                        global_model = self.global_estimator().fit(dists * predicts, y)
-                else:
-                    global_model = None
-
-                self._replications.append(ReplicationR(global_model, local_models))
+                for i, (features, local_models) in zip(replications, fitted):
+                    global_model = self._fit_global(features, y, i)
+                    self._replications.append(ReplicationR(global_model, local_models))
 
         return self
 
@@ -474,88 +1749,301 @@ class _LESS(BaseEstimator, SklearnEstimator):
         Clustering is used (no tree method)
         '''
 
-        self.replications_ = []
-        for i in range(self.n_replications_):
-            if rank ==0:
-                # Split for global estimation
-                X_train, X_val, y_train, y_val = train_test_split(X, y,
-                    test_size=self.val_size_,
-                    random_state=self.rng_.integers(np.iinfo(np.int16).max))
+        len_X: int = len(X)
+        # Size of the training split (as in train_test_split)
+        len_X_train: int = len_X - int(np.ceil(self.val_size * len_X))
+        # Check the validity of the input
+        self._check_input(len_X_train)
+        for replications in self._replication_rounds():
+            # Split for global estimation: every rank draws the same seeds
+            # and slices its own copy of X
+            seeds = [self._replication_rng(i, _STREAM_SPLIT).integers(np.iinfo(np.int16).max)
+                     for i in replications]
+            splits = [self._split_indices(len_X, seed) for seed in seeds]
+            subsets, centers = [], []
+            for i, (train_indices, _) in zip(replications, splits):
+                cluster_subsets, cluster_centers = self._cluster(X[train_indices], i)
+                # Clusters are mapped back to the rows of X
+                subsets.append([train_indices[subset] for subset in cluster_subsets])
+                centers.append(cluster_centers)
+                self.n_subsets.append(len(cluster_subsets))
+            val_indices_list = [val_indices for _, val_indices in splits]
+            fitted = self._fit_helper(X, y, subsets, val_indices_list, centers)
+            if rank == 0:
+                for i, (features, local_models), val_indices in zip(replications, fitted, val_indices_list):
+                    global_model = self._fit_global(features, y[val_indices], i)
+                    self._replications.append(ReplicationR(global_model, local_models))
+
+        return self
+
+    def _keep_online_sample(self, X: np.array, y: np.array, sharded: bool = False):
+        '''
+        Keeps online_sample_size many training samples (drawn with a seed broadcast from
+        rank 0, so that all ranks keep the same samples) on which update refits the global
+        estimators. With sharded, X and y are the local shard, and the sample is drawn over
+        the rows of all ranks.
+        '''
+
+        if not self.online:
+            return
+        # A separate stream, so that the fit itself does not depend on online
+        seed = None
+        if rank == 0:
+            seed = np.random.default_rng(self.random_state).integers(np.iinfo(np.int32).max)
+        rng = np.random.default_rng(comm.bcast(seed, root=0))
+        if sharded:
+            len_X_locals = comm.allgather(len(X))
+            offsets = np.cumsum([0] + len_X_locals)
+            indices = np.sort(rng.choice(offsets[-1], size=min(self.online_sample_size, offsets[-1]),
+                                         replace=False))
+            owned = indices[(indices >= offsets[rank]) & (indices < offsets[rank+1])] - offsets[rank]
+            self._communicated_object('online_sample_comm', X[owned])
+            self._communicated_object('online_sample_comm', y[owned])
+            X_sample = np.concatenate(comm.allgather(X[owned]))
+            y_sample = np.concatenate(comm.allgather(y[owned]))
+        else:
+            indices = np.sort(rng.choice(len(X), size=min(self.online_sample_size, len(X)), replace=False))
+            X_sample, y_sample = X[indices], y[indices]
+        self._online_sample = (X_sample, y_sample, offsets[-1] if sharded else len(X))
+        self._online_rng = rng
+
+    def _add_online_sample(self, X: np.array, y: np.array):
+        '''
+        Adds the new samples to the kept training samples by reservoir sampling,
+        so that the kept samples remain a uniform sample of all samples seen so far
+        '''
+
+        X_sample, y_sample, n_seen = self._online_sample
+        n_free = min(self.online_sample_size - len(y_sample), len(y))
+        X_sample = np.concatenate((X_sample, X[:n_free]))
+        y_sample = np.concatenate((y_sample, y[:n_free]))
+        n_seen += n_free
+        # Each further sample replaces a kept one with probability online_sample_size / n_seen
+        replaced = self._online_rng.integers(0, n_seen + np.arange(1, len(y) - n_free + 1))
+        for j in np.flatnonzero(replaced < self.online_sample_size):
+            X_sample[replaced[j]], y_sample[replaced[j]] = X[n_free + j], y[n_free + j]
+        self._online_sample = (X_sample, y_sample, n_seen + len(y) - n_free)
+
+    def _update_replications(self, X: np.array, y: np.array):
+        '''
+        Routes the new samples to the subsets with the nearest centers and updates the
+        local estimators and the centers of those subsets with the sufficient statistics.
+        The global estimators are then refitted on the kept training samples (see
+        online_sample_size), which include the new ones. The kept samples are drawn from
+        all training samples, and the new samples also update the local estimators, so
+        the split of val_size is not kept by update. Each rank updates the replications
+        it evaluates in predict, so update must be called like predict (by all ranks with
+        parallel_predict, which then exchange their updated replications).
+        '''
+
+        if not self.online or getattr(self, '_online_sample', None) is None:
+            raise ValueError('The model can be updated only if it is fitted with online set to True.')
+        self._add_online_sample(X, y)
+        X_sample, y_sample, _ = self._online_sample
+        Z = np.column_stack((np.ones(len(X)), X))
+        for i in self._replication_indices():
+            if i >= len(self._replications):
+                break
+            replication, compiled = self._replications[i], self._compiled[i]
+            if compiled.coefs is None or any(local_model.stats is None
+                                             for local_model in replication.local_estimators):
+                raise ValueError('Only linear local estimators fitted with online set to True can be updated.')
+            local_models = list(replication.local_estimators)
+            nearest = np.argmin(_sqeuclidean(X, compiled.centers), axis=1)
+            for s in np.unique(nearest):
+                rows = nearest == s
+                gram, moment = local_models[s].stats
+                gram = gram + Z[rows].T @ Z[rows]
+                moment = moment + Z[rows].T @ y[rows]
+                # Least squares solution of the subset with the new samples
+                theta = np.linalg.lstsq(gram, moment, rcond=None)[0]
+                center = gram[0, 1:] / gram[0, 0]
+                compiled.centers[s], compiled.coefs[s], compiled.intercepts[s] = center, theta[1:], theta[0]
+                estimator = local_models[s].estimator
+                estimator.coef_, estimator.intercept_ = theta[1:], theta[0]
+                local_models[s] = LocalModelR(estimator=estimator, center=center, stats=(gram, moment))
+            self._replications[i] = ReplicationR(replication.global_estimator, local_models)
+            if getattr(self, '_center_trees', None) is not None:
+                self._center_trees.pop(i, None)
+
+            # The features of the kept samples change with the local estimators
+            global_model = replication.global_estimator
+            if global_model is not None:
+                global_model.fit(self._replication_features(X_sample, i), y_sample)
+
+        if self.parallel_predict and number_of_workers > 1:
+            # Every rank receives the replications updated by the others,
+            # so that the model can be saved by any rank
+            updated = [(i, self._replications[i], self._compiled[i])
+                       for i in self._replication_indices() if i < len(self._replications)]
+            self._communicated_object('update_comm', updated)
+            for part in comm.allgather(updated):
+                for i, replication, compiled in part:
+                    self._replications[i], self._compiled[i] = replication, compiled
+                    if getattr(self, '_center_trees', None) is not None:
+                        self._center_trees.pop(i, None)
+
+    def _shard_split(self, len_X_local: int, seed: int):
+        '''
+        Returns the training and validation indices of the local shard of a replication.
+        Every rank splits its own shard with the broadcast seed.
+        '''
+
+        permutation = np.random.default_rng([seed, rank]).permutation(len_X_local)
+        len_val = int(np.ceil(self.val_size * len_X_local))
+        return np.sort(permutation[len_val:]), np.sort(permutation[:len_val])
+
+    def _route_neighbors(self, X_train: np.array, y_train: np.array, len_X_trains: np.array, i: int, key=None):
+        '''
+        Selects n_subsets many anchor samples of the i-th replication from the training shards of all ranks
+        (len_X_trains holds the shard sizes) and collects the nearest neighbors of
+        each anchor on the rank that trains its subset. Every rank queries a tree
+        grown on its own shard (identified by key, see _tree) and sends the distances of its candidates to the owners
+        of the subsets, which request only the rows of the n_neighbors nearest ones.
+        Returns the (Xneighbors, yneighbors) of the subsets assigned to this rank.
+        '''
+
+        train_offsets = np.cumsum([0] + list(len_X_trains))
+        # Every rank draws the same anchors, and fills in the rows it owns
+        rng = self._replication_rng(i, _STREAM_ANCHORS)
+        anchor_indices = rng.choice(train_offsets[-1], size=self.n_subsets)
+        anchors = np.zeros((self.n_subsets, X_train.shape[1]))
+        owned = (anchor_indices >= train_offsets[rank]) & (anchor_indices < train_offsets[rank+1])
+        anchors[owned] = X_train[anchor_indices[owned] - train_offsets[rank]]
+        comm.Allreduce(MPI.IN_PLACE, anchors, op=MPI.SUM)
+
+        # Candidates of the local shard (k_candidates[worker] per anchor on each rank)
+        k_candidates = [min(self.n_neighbors, len_X_train) for len_X_train in len_X_trains]
+        if k_candidates[rank] > 0:
+            dists, neighbors = self._tree(X_train, key).query(anchors, k=k_candidates[rank])
+        else:
+            dists, neighbors = np.zeros((self.n_subsets, 0)), np.zeros((self.n_subsets, 0), dtype=int)
+        jobs = [self._assigned_jobs(self.n_subsets, worker) for worker in range(number_of_workers)]
+        candidate_dists = _alltoallv([dists[job.start:job.stop].ravel() for job in jobs])
+
+        # The owner keeps the nearest candidates of all ranks and requests their rows
+        # (positions refer to the candidates sent by each rank)
+        sources = np.repeat(np.arange(number_of_workers), k_candidates)
+        requests = [[np.zeros(0, dtype='i')] for worker in range(number_of_workers)]
+        # The rows arrive in the order of the candidates, and are put back in the
+        # order of their distances (as they are on a single rank)
+        distance_orders = []
+        for j in range(len(jobs[rank])):
+            positions = np.concatenate([j*k + np.arange(k) for k in k_candidates])
+            subset_dists = np.concatenate([candidate_dists[worker][j*k:(j+1)*k]
+                                           for worker, k in enumerate(k_candidates)])
+            nearest = np.argsort(subset_dists, kind='stable')[:self.n_neighbors]
+            distance_orders.append(np.argsort(np.argsort(nearest)))
+            for worker in range(number_of_workers):
+                requests[worker].append(np.sort(positions[nearest][sources[nearest] == worker]))
+        requests = [np.concatenate(request).astype('i') for request in requests]
+        requested = _alltoallv(requests)
+
+        # Every rank sends the requested rows (with their targets in the last column)
+        k = k_candidates[rank]
+        sendrows = []
+        for job, positions in zip(jobs, requested):
+            rows = neighbors[job.start + positions // max(k, 1), positions % max(k, 1)]
+            sendrows.append(np.column_stack((X_train[rows], y_train[rows])))
+        received = _alltoallv(sendrows)
+
+        subsets = []
+        for j in range(len(jobs[rank])):
+            rows = np.concatenate([received[worker][requests[worker] // max(k, 1) == j]
+                                   for worker, k in enumerate(k_candidates)])[distance_orders[j]]
+            subsets.append((rows[:, :-1], rows[:, -1].astype(y_train.dtype)))
+        return subsets
+
+    def _fit_sharded(self, X_local: np.array, y_local: np.array):
+        '''
+        Fit function for the data distributed over the ranks (see fit_sharded)
+        Tree method is used (no clustering), with or without validation
+        '''
+
+        if self.cluster_method is not None:
+            raise ValueError('Fitting with sharded data does not support cluster_method.')
+        len_X_locals = np.array(comm.allgather(len(X_local)))
+        if self.val_size is not None:
+            len_X_evals = np.ceil(self.val_size * len_X_locals).astype(int)
+            len_X_trains = len_X_locals - len_X_evals
+        else:
+            len_X_evals = len_X_locals
+            len_X_trains = len_X_locals
+        # Check the validity of the input
+        self._check_input(int(np.sum(len_X_trains)))
+        # Without validation, the tree of the training shard is grown once
+        self._tree_cache = None
+        for i in range(self._first_replication, self.n_replications):
+            if self.val_size is not None:
+                # Split for global estimation: every rank draws the same seed
+                seed = self._replication_rng(i, _STREAM_SPLIT).integers(np.iinfo(np.int16).max)
+                train_indices, eval_indices = self._shard_split(len(X_local), seed)
+                key = ('shard', seed)
             else:
-                len_x_val = int(len(X) * self.val_size)
-                len_y_val = int(len(y) * self.val_size)
-                len_x_train = int(len(X) * (1-self.val_size))
-                len_y_train = int(len(y) * (1-self.val_size))
-                X_train = np.empty((len_x_train,X[0].shape[0]))
-                y_train = np.empty(len_y_train)
-                X_val = np.empty((len_x_val,X[0].shape[0]))
-                y_val = np.empty(len_y_val)
-            
-            X_train = comm.bcast(X_train, root=0)
-            X_val = comm.bcast(X_val, root=0)
-            y_train = comm.bcast(y_train, root=0)
-            y_val = comm.bcast(y_val,root=0)  
-            len_X_val: int = len(X_val)
-            len_X_train: int = len(X_train)
-            # Check the validity of the input
-            if (i == 0):
-                use_cluster_centers = False
-                self._check_input(len_X_train)
-
- 
-            if(rank == 0):
-                 if 'random_state' not in self.cluster_method().get_params().keys():
-                     cluster_fit = self.cluster_method().fit(X_train)
-                 else:
-                     cluster_fit = self.cluster_method().\
-                         set_params(random_state=self._rng.integers(np.iinfo(np.int16).max)).\
-                             fit(X_train)
-                 cluster_fit_labels = cluster_fit.labels
-                 cluster_fit_centers = cluster_fit.cluster_centers
-                 n_clusters = cluster_fit_centers.shape[0]
-                 n_features = cluster_fit_centers.shape[1]
+                train_indices, eval_indices = slice(None), slice(None)
+                key = 'shard'
+
+            with self._phase('route_neighbors'):
+                subsets = self._route_neighbors(X_local[train_indices], y_local[train_indices],
+                                                len_X_trains, i, key)
+            # The subsets of this rank are the block _assigned_jobs(n_subsets)
+            first_subset = self._assigned_jobs(self.n_subsets).start
+            with self._phase('local_fit', i):
+                local_models = self._map(lambda j: self._local_model(subsets[j][0], subsets[j][1],
+                                                                     np.mean(subsets[j][0], axis=0),
+                                                                     self._local_seed(i, first_subset + j)),
+                                         range(len(subsets)))
+            # Every rank evaluates all local models on its own evaluation samples
+            self._communicated_object('share_local_models', local_models)
+            with self._phase('share_local_models'):
+                local_models = [local_model for models in comm.allgather(local_models)
+                                for local_model in models]
+            X_eval = X_local[eval_indices]
+            if self.n_nearest_subsets is not None:
+                # Each row of the sparse (CSR) features has k nonzeros, so only
+                # the data and the column indices are gathered
+                k = min(self.n_nearest_subsets, self.n_subsets)
+                if len(X_eval) > 0:
+                    features = self._sparse_features(X_eval, local_models,
+                                                     self._compile_local_models(local_models))
+                    sendbuf, sendindices = features.data, features.indices.astype('i')
+                else:
+                    sendbuf, sendindices = np.zeros(0), np.zeros(0, dtype='i')
+                counts = [len_X_eval*k for len_X_eval in len_X_evals]
             else:
-                 n_clusters = 0
-                 n_features = 0
-                 cluster_fit_labels = np.zeros([n_clusters, n_features], dtype = 'i')
-                 cluster_fit_centers = np.zeros([n_clusters, n_features], dtype = 'd')
-            n_clusters = comm.bcast(n_clusters, root=0)
-            n_features = comm.bcast(n_features, root=0)
-            cluster_fit_labels = comm.bcast(cluster_fit_labels, root=0) 
-            cluster_fit_centers = comm.bcast(cluster_fit_centers, root=0) 
-            if (rank == 0):
-                if (i==1):
-                    if (hasattr(cluster_fit, 'cluster_centers')):
-                        use_cluster_centers = True
-                    else:
-                        use_cluster_centers = False
-            use_cluster_centers = comm.bcast(use_cluster_centers, root=0)  
-            # Since each replication returns
-            self.n_subsets_.append(len(np.unique(cluster_fit_labels)))
-            n_subsets = self.n_subsets[i]
-            
-            local_models: List[LocalModelR] = []
-            dists = np.zeros((len_X_val, n_subsets))            
-            predicts = np.zeros((len_X_val, n_subsets))
-                
-            [predicts,dists,local_models] = self._fit_helperc(X_train,y_train,cluster_fit_labels,cluster_fit_centers,use_cluster_centers,i,X_val)
-            if (rank == 0):
-                # Normalize the distances from samples to the local subsets
-                if self.d_normalize:
-                    denom = np.sum(dists, axis=1)
-                    denom[denom < 1.0e-8] = 1.0e-8
-                    dists = (dists.T/denom).T 
-                if (self.global_estimator_ != None):
-                    if ('random_state' in self.global_estimator().get_params().keys()):
-                        global_model = self.global_estimator().\
-                            set_params(random_state=self._rng.integers(np.iinfo(np.int16).max)).\
-                                fit(dists * predicts, y_val)
-                    else:
-                        global_model = self.global_estimator().fit(dists * predicts, y_val)
+                if len(X_eval) > 0:
+                    features = self._features(X_eval, local_models, self._compile_local_models(local_models))
                 else:
-                    global_model = None
-
-                self.replications_.append(ReplicationR(global_model, local_models))
+                    features = np.zeros((0, self.n_subsets))
+                sendbuf = np.ascontiguousarray(features).ravel()
+                counts = [len_X_eval*self.n_subsets for len_X_eval in len_X_evals]
+
+            self._communicated('features_comm', sendbuf)
+            if self.n_nearest_subsets is not None:
+                self._communicated('features_comm', sendindices)
+            self._communicated_object('targets_comm', y_local[eval_indices])
+            with self._phase('features_comm'):
+                y_evals = comm.gather(y_local[eval_indices], root=0)
+                if rank != 0:
+                    comm.Gatherv(sendbuf, None, root=0)
+                    if self.n_nearest_subsets is not None:
+                        comm.Gatherv(sendindices, None, root=0)
+                    continue
+                displs = np.cumsum([0] + counts[:-1])
+                recvbuf = np.empty(sum(counts))
+                comm.Gatherv(sendbuf, [recvbuf, counts, displs, MPI.DOUBLE], root=0)
+                if self.n_nearest_subsets is not None:
+                    recvindices = np.empty(sum(counts), dtype='i')
+                    comm.Gatherv(sendindices, [recvindices, counts, displs, MPI.INT], root=0)
+            len_X_eval = int(np.sum(len_X_evals))
+            if self.n_nearest_subsets is not None:
+                features = csr_matrix((recvbuf, recvindices, np.arange(0, len_X_eval*k+1, k)),
+                                      shape=(len_X_eval, self.n_subsets))
+            else:
+                features = recvbuf.reshape(len_X_eval, self.n_subsets)
+            global_model = self._fit_global(features, np.concatenate(y_evals), i)
+            self._replications.append(ReplicationR(global_model, local_models))
+        self._tree_cache = None
 
         return self
 
@@ -654,18 +2142,63 @@ class LESSClassifier(_LESS, ClassifierMixin):
         tree_method : method used for constructing the nearest neighbor tree,
                 e.g., sklearn.neighbors.KDTree (default) or sklearn.neighbors.BallTree
         cluster_method : method used for clustering the subsets,
-                e.g., sklearn.cluster.KMeans, sklearn.cluster.SpectralClustering (default is None)
+                e.g., sklearn.cluster.KMeans, sklearn.cluster.SpectralClustering, or the
+                distributed MPIKMeans (default is None)
         local_estimator : estimator for training the local models
                 (default is LinearRegression)
         global_estimator : estimator for training the global model
                 (default is DecisionTreeClassifier)
         distance_function : distance function evaluating the distance from a subset to a sample,
                 e.g., df(subset, sample) which returns a vector of distances
-                (default is RBF(subset, sample, 1.0/n_subsets^2))
+                (default is RBF(subset, sample, 1.0/n_subsets^2)); functions marked with
+                lessmpi.batched are called once as df(samples, centers) for all subsets
+        distance_block_size : number of samples for which the default RBF distances are evaluated
+                at a time, which bounds the temporary memory of the distance matrix (default is None,
+                all samples at once)
         scaling: flag to normalize the input data (default is True)
         warnings : flag to turn on (True) or off (False) the warnings (default is True)
         multiclass : available strategies are 'ovr' (one-vs-rest, default), 
-                'ovo' (one-vs-one), 'occ' (output-code-classifier)
+                'ovo' (one-vs-one), 'occ' (output-code-classifier), and 'native', which fits
+                a single LESS model whose subsets and multi-output local estimators
+                (one output per class) are shared by all classes; with 'ovo', predict returns
+                the class with the largest sum of the pairwise probabilities (soft voting)
+        parallel_predict : flag to distribute the replications over the MPI ranks
+                during prediction; predict then needs to be called by all ranks (default is False)
+        parallel_mode : 'subsets' (default) distributes the subsets of each replication over
+                the MPI ranks, 'replications' distributes all (replication, subset) pairs at once
+                so that the whole fit has a single synchronization point
+        scheduler : 'static' (default) assigns contiguous blocks of local models to the MPI ranks,
+                'dynamic' hands out the local models on request in the order of decreasing subset size,
+                where rank 0 acts as the master; the fitted local models are the same with both schedulers
+        shared_memory : flag to place the (scaled) training data in an MPI-3 shared-memory window,
+                so that the ranks on one node share a single copy; training data created by
+                lessmpi.shared_array is not copied if copy_X is False or scaling is off, in which case
+                it is scaled in place (default is False)
+        parallel_query : flag to grow the nearest neighbor tree on all MPI ranks and split the
+                neighbor queries of the subsets over them (default is False, only rank 0 grows and queries the tree)
+        copy_X : flag to scale a copy of the training data; if False, X is scaled in place
+                (overwritten) and the scaling statistics are computed collectively over the MPI ranks;
+                an X that is not writeable or not floating-point is still copied (default is True)
+        batch_size : number of test samples predicted at a time, which bounds the temporary
+                memory of predict; see also predict_iter (default is None, all samples at once)
+        n_nearest_subsets : number of nearest local centers (found with a tree over the centers)
+                whose local models are evaluated for each sample; the input of the global estimator is
+                then a sparse (CSR) matrix, which the global estimator must accept (default is None, all subsets)
+        warm_start : flag to keep the fitted replications (and the scaling) when fit is called
+                again, so that only the replications added by increasing n_replications are fitted;
+                with the same data, these are the replications of a fresh fit with the same
+                random_state (in either parallel_mode) (default is False)
+        online : flag to keep the sufficient statistics of the linear local estimators,
+                so that the fitted model can be updated with new samples by update(X, y); the local
+                estimator must be LinearRegression with an intercept (default is False)
+        profiler : lessmpi.Profiler object recording the time of the phases of fit and predict
+                and the bytes of the collectives on each rank; see Profiler.report (default is None, no profiling)
+        n_threads : number of threads of each MPI rank fitting its local estimators (and evaluating
+                the local estimators that are not linear in predict), so that a rank can use several cores; with
+                scheduler 'dynamic', each request of a rank is served with n_threads local estimators (default is 1)
+        online_sample_size : number of training samples kept (by reservoir sampling over fit and update)
+                when online is True, on which update(X, y) refits the global estimators; these samples
+                are not restricted to the validation samples, i.e., update ignores val_size (default is 10000)
 
     Recommendation
     --------------
@@ -688,7 +2221,11 @@ class LESSClassifier(_LESS, ClassifierMixin):
                 local_estimator=lambda: LinearRegression(),
                 global_estimator=lambda: DecisionTreeClassifier(),
                 distance_function: Callable[[np.array, np.array], np.array]=None,
-                scaling=True, warnings=True, multiclass='ovr'):
+                scaling=True, warnings=True, multiclass='ovr',
+                parallel_predict=False, parallel_mode='subsets', scheduler='static',
+                shared_memory=False, parallel_query=False, copy_X=True, batch_size=None,
+                n_nearest_subsets=None, warm_start=False, online=False, profiler=None,
+                n_threads=1, online_sample_size=10000, distance_block_size=None):
 
         self.local_estimator = local_estimator
         self.global_estimator = global_estimator
@@ -702,11 +2239,26 @@ class LESSClassifier(_LESS, ClassifierMixin):
         self.d_normalize = d_normalize
         self.val_size = val_size
         self.random_state = random_state
+        self._rng = np.random.default_rng(self.random_state)
         self._bclassifier = None
         self._strategy = None
         self.scaling = scaling
         self.warnings = warnings
         self.multiclass = multiclass
+        self.parallel_predict = parallel_predict
+        self.parallel_mode = parallel_mode
+        self.scheduler = scheduler
+        self.shared_memory = shared_memory
+        self.parallel_query = parallel_query
+        self.copy_X = copy_X
+        self.batch_size = batch_size
+        self.n_nearest_subsets = n_nearest_subsets
+        self.warm_start = warm_start
+        self.online = online
+        self.profiler = profiler
+        self.n_threads = n_threads
+        self.online_sample_size = online_sample_size
+        self.distance_block_size = distance_block_size
 
         class _LESSBC(_LESS):
             '''
@@ -722,7 +2274,12 @@ class LESSClassifier(_LESS, ClassifierMixin):
                         local_estimator=lambda: LinearRegression(),
                         global_estimator=lambda: DecisionTreeClassifier(),
                         distance_function: Callable[[np.array, np.array], np.array]=None,
-                        warnings=True):
+                        warnings=True, parallel_predict=False,
+                        parallel_mode='subsets', scheduler='static', shared_memory=False,
+                        parallel_query=False, copy_X=True, batch_size=None,
+                        n_nearest_subsets=None, warm_start=False, online=False,
+                        profiler=None, n_threads=1, online_sample_size=10000,
+                        distance_block_size=None):
 
                 self.local_estimator = local_estimator
                 self.global_estimator = global_estimator
@@ -738,6 +2295,20 @@ class LESSClassifier(_LESS, ClassifierMixin):
                 self.random_state = random_state
                 self._rng = np.random.default_rng(self.random_state)
                 self.warnings = warnings
+                self.parallel_predict = parallel_predict
+                self.parallel_mode = parallel_mode
+                self.scheduler = scheduler
+                self.shared_memory = shared_memory
+                self.parallel_query = parallel_query
+                self.copy_X = copy_X
+                self.batch_size = batch_size
+                self.n_nearest_subsets = n_nearest_subsets
+                self.warm_start = warm_start
+                self.online = online
+                self.profiler = profiler
+                self.n_threads = n_threads
+                self.online_sample_size = online_sample_size
+                self.distance_block_size = distance_block_size
 
             def fit(self, X: np.array, y: np.array):
                 '''
@@ -767,7 +2338,7 @@ class LESSClassifier(_LESS, ClassifierMixin):
                 y[ymin1] = -1
                 y[ypls1] = 1
 
-                self._set_local_attributes()
+                self._prepare_fit()
 
                 if self.val_size is not None:
                     # Validation set is used for
@@ -783,6 +2354,7 @@ class LESSClassifier(_LESS, ClassifierMixin):
                         self._fitnoval(X, y)
                     else:
                         self._fitnovalc(X, y)
+                self._keep_online_sample(X, y)
 
                 # Convert to original labels
                 ymin1 = y == -1
@@ -790,7 +2362,43 @@ class LESSClassifier(_LESS, ClassifierMixin):
                 y[ymin1] = self._yorg[0]        
                 y[ypls1] = self._yorg[1]
 
-                self._isfitted = True
+                self._finish_fit()
+
+                return self
+
+            def fit_sharded(self, X_local: np.array, y_local: np.array):
+                '''
+                Fit function for the data distributed over the MPI ranks
+                (see LESSClassifier.fit_sharded)
+                '''
+
+                X_local, y_local = check_X_y(X_local, y_local, ensure_min_samples=0)
+
+                # Original labels (of all shards)
+                self._yorg = np.unique(np.concatenate(comm.allgather(np.unique(y_local))))
+
+                if len(self._yorg) != 2:
+                    raise ValueError('LESSBinaryClassifier works only with two labels. \
+                                    Please try LESSClassifier.')
+
+                # Convert to binary labels (the shard is not modified)
+                y_local = np.where(y_local == self._yorg[0], -1, 1)
+
+                self._prepare_fit()
+                self._fit_sharded(X_local, y_local)
+                self._keep_online_sample(X_local, y_local, sharded=True)
+                self._finish_fit()
+
+                return self
+
+            def update(self, X: np.array, y: np.array):
+                '''
+                Updates the fitted binary classifier with new samples
+                (see LESSClassifier.update)
+                '''
+
+                X, y = check_X_y(X, y)
+                self._update_replications(X, np.where(y == self._yorg[0], -1, 1))
 
                 return self
 
@@ -805,40 +2413,20 @@ class LESSClassifier(_LESS, ClassifierMixin):
 
                 len_X0: int = len(X0)
                 yhat = np.zeros((len_X0, self.n_replications))
-                for i in range(self.n_replications):
-                    # Get the fitted global and local estimators
+                for i in self._replication_indices():
+                    # Get the fitted global estimator
                     global_model = self._replications[i].global_estimator
-                    local_models = self._replications[i].local_estimators
-                    if self.cluster_method is None:
-                        n_subsets = self.n_subsets
-                    else:
-                        n_subsets = self.n_subsets[i]
-                    predicts = np.zeros((len_X0, n_subsets))
-                    dists = np.zeros((len_X0, n_subsets))
-                    for j in range(n_subsets):
-                        local_center = local_models[j].center
-                        local_model = local_models[j].estimator
-                        predicts[:, j] = local_model.predict(X0)
-
-                        if self.distance_function is None:
-                            dists[:, j] = rbf(X0, local_center, \
-                                coeff=1.0/np.power(n_subsets, 2.0))
-                        else:
-                            dists[:, j] = self.distance_function(X0, local_center)
-
-                    # Normalize the distances from samples to the local subsets
-                    if self.d_normalize:
-                        denom = np.sum(dists, axis=1)
-                        denom[denom < 1.0e-8] = 1.0e-8
-                        dists = (dists.T/denom).T
+                    features = self._replication_features(X0, i)
 
                     if global_model is not None:
-                        yhat[:, i] = global_model.predict(dists * predicts)
+                        yhat[:, i] = global_model.predict(features)
                     else:
-                        rowsums = np.sum(dists * predicts, axis=1)
+                        rowsums = np.asarray(features.sum(axis=1)).ravel()
                         yhat[rowsums < 0, i] = -1
                         yhat[rowsums >= 0, i] = 1
 
+                # Each rank fills only its own columns
+                yhat = self._reduce_predictions(yhat)
                 yhat = mode(yhat.astype(int), axis=1).mode.reshape(1, -1)[0]
 
                 # Convert to original labels
@@ -858,58 +2446,9 @@ class LESSClassifier(_LESS, ClassifierMixin):
                 # Input validation
                 X0 = check_array(X0)
 
-                len_X0: int = len(X0)
-                yhat = np.zeros((len_X0, self.n_replications), dtype=np.int)
-                predprobs = np.zeros((len_X0, 2), dtype=np.float16)
-                for i in range(self.n_replications):
-                    # Get the fitted global and local estimators
-                    global_model = self._replications[i].global_estimator
-                    local_models = self._replications[i].local_estimators
-                    if self.cluster_method is None:
-                        n_subsets = self.n_subsets
-                    else:
-                        n_subsets = self.n_subsets[i]
-                    predicts = np.zeros((len_X0, n_subsets))
-                    dists = np.zeros((len_X0, n_subsets))
-                    for j in range(n_subsets):
-                        local_center = local_models[j].center
-                        local_model = local_models[j].estimator
-                        predicts[:, j] = local_model.predict(X0)
-
-                        if self.distance_function is None:
-                            dists[:, j] = rbf(X0, local_center, \
-                                coeff=1.0/np.power(n_subsets, 2.0))
-                        else:
-                            dists[:, j] = self.distance_function(X0, local_center)
-
-                    # Normalize the distances from samples to the local subsets
-                    if self.d_normalize:
-                        denom = np.sum(dists, axis=1)
-                        denom[denom < 1.0e-8] = 1.0e-8
-                        dists = (dists.T/denom).T
-
-                    if global_model is not None:
-                        yhat[:, i] = global_model.predict(dists * predicts)
-                        # Convert to 0-1
-                        yhat[:, i] = (yhat[:, i] + 1)/2
-                    else:
-                        rowsums = np.sum(dists * predicts, axis=1)
-                        yhat[rowsums < 0, i] = 0
-                        yhat[rowsums >= 0, i] = 1
-
-                md, cnt = mode(yhat, axis=1)
-                yhat = md.reshape(1, -1)[0]
-                cnt = cnt.reshape(1, -1)[0]
-                yhat0 = yhat==0
-                yhat1 = yhat==1
-                predprobs[yhat0, 0] = cnt[yhat0]
-                predprobs[yhat0, 1] = self.n_replications - cnt[yhat0]
-                predprobs[yhat1, 1] = cnt[yhat1]
-                predprobs[yhat1, 0] = self.n_replications - cnt[yhat1]
-
-                predprobs /= self.n_replications
-
-                return predprobs
+                # The columns of the labels -1 and 1 are those of the original labels
+                return self._mean_proba(X0, np.array([-1, 1]),
+                    lambda features: (np.asarray(features.sum(axis=1)).ravel() >= 0).astype(int))
 
         self._bclassifier = _LESSBC(frac=self.frac, n_neighbors=self.n_neighbors,
                                     n_subsets=self.n_subsets,
@@ -922,38 +2461,308 @@ class LESSClassifier(_LESS, ClassifierMixin):
                                     local_estimator=self.local_estimator,
                                     global_estimator=self.global_estimator,
                                     distance_function=self.distance_function,
-                                    warnings=self.warnings)
+                                    warnings=self.warnings,
+                                    parallel_predict=self.parallel_predict,
+                                    parallel_mode=self.parallel_mode,
+                                    scheduler=self.scheduler,
+                                    shared_memory=self.shared_memory,
+                                    parallel_query=self.parallel_query,
+                                    copy_X=self.copy_X,
+                                    batch_size=self.batch_size,
+                                    n_nearest_subsets=self.n_nearest_subsets,
+                                    warm_start=self.warm_start,
+                                    online=self.online,
+                                    profiler=self.profiler,
+                                    n_threads=self.n_threads,
+                                    online_sample_size=self.online_sample_size,
+                                    distance_block_size=self.distance_block_size)
 
     def fit(self, X: np.array, y: np.array):
         '''
         Dummy fit function that calls the fit method of the multiclass strategy 'one-vs-rest'
         '''
-        if (self.scaling):
-            self._scobject = StandardScaler()
-            X = self._scobject.fit_transform(X)
+        with self._phase('scaling'):
+            X, window = self._scale_training_data(X)
 
         n_classes = len(np.unique(y))
         
-        self._set_strategy(n_classes)
+        if self.multiclass == 'native':
+            self._fit_native(X, y)
+        elif self._warm():
+            self._fit_strategy_warm(X, y)
+        else:
+            self._set_strategy(n_classes)
+            self._strategy.fit(X, y)
 
-        self._strategy.fit(X, y)
+        if window is not None:
+            window.Free()
        
-        self._update_params(self._strategy.estimators_[0], n_classes)
+        if self.multiclass != 'native':
+            self._update_params(self._strategy.estimators_[0], n_classes)
         
         self._isfitted = True
 
         return self
 
+    def _fit_native(self, X: np.array, y: np.array):
+        '''
+        Fit function of the native multiclass option: the neighborhoods, the distances
+        and the local estimators of each replication are computed once for all classes,
+        where the local estimators are fitted to the one-vs-rest labels of all classes
+        at once (multi-output), and a single global classifier is trained on the features
+        of all (subset, class) pairs
+        '''
+
+        X, y = check_X_y(X, y)
+        classes = np.unique(y)
+        if self._warm() and not np.array_equal(classes, self._yorg):
+            raise ValueError('The classes should not change when warm_start is set.')
+        if self.n_nearest_subsets is not None:
+            raise ValueError('The multiclass option \'native\' does not support n_nearest_subsets.')
+
+        # Original labels
+        self._yorg = classes
+        # One output per class: 1 for the samples of the class and -1 otherwise
+        Y = np.where(y[:, None] == classes, 1.0, -1.0)
+
+        self._prepare_fit()
+
+        if self.val_size is not None:
+            if self.cluster_method is None:
+                self._fitval(X, Y)
+            else:
+                self._fitvalc(X, Y)
+        else:
+            if self.cluster_method is None:
+                self._fitnoval(X, Y)
+            else:
+                self._fitnovalc(X, Y)
+
+        self._finish_fit()
+
+    def fit_sharded(self, X_local: np.array, y_local: np.array):
+        '''
+        Fit function for the data distributed over the MPI ranks: each rank passes
+        only its own rows (X_local, y_local) and must call fit_sharded. The binary
+        problems of the multiclass strategy ('ovr' or 'ovo') are fitted one by one
+        as in LESSRegressor.fit_sharded, and the fitted binary classifiers are placed
+        in the strategy object, which is used for predict as after fit.
+        '''
+
+        if self.multiclass == 'native':
+            raise ValueError('Fitting with sharded data supports only the multiclass options \'ovr\' and \'ovo\'.')
+
+        X_local, y_local = check_X_y(X_local, y_local, ensure_min_samples=0)
+
+        with self._phase('scaling'):
+            X_local = self._scale_sharded_data(X_local)
+
+        classes = np.unique(np.concatenate(comm.allgather(np.unique(y_local))))
+        n_classes = len(classes)
+
+        self._set_strategy(n_classes)
+
+        if isinstance(self._strategy, OneVsRestClassifier):
+            label_binarizer = LabelBinarizer(sparse_output=False).fit(classes)
+            Y_local = label_binarizer.transform(y_local)
+            self._strategy.label_binarizer_ = label_binarizer
+            self._strategy.classes_ = classes
+            self._strategy.estimators_ = [clone(self._bclassifier).fit_sharded(X_local, Y_local[:, i])
+                                          for i in range(Y_local.shape[1])]
+        elif isinstance(self._strategy, OneVsOneClassifier):
+            estimators = []
+            for i in range(n_classes):
+                for j in range(i + 1, n_classes):
+                    pair = (y_local == classes[i]) | (y_local == classes[j])
+                    y_pair = (y_local[pair] == classes[j]).astype(int)
+                    estimators.append(clone(self._bclassifier).fit_sharded(X_local[pair], y_pair))
+            self._strategy.classes_ = classes
+            self._strategy.estimators_ = estimators
+            self._strategy.pairwise_indices_ = None
+        else:
+            raise ValueError('Fitting with sharded data supports only the multiclass options \'ovr\' and \'ovo\'.')
+        self._strategy.n_features_in_ = X_local.shape[1]
+
+        self._update_params(self._strategy.estimators_[0], n_classes)
+
+        self._isfitted = True
+
+        return self
+
     def predict(self, X0: np.array):
         '''
         Dummy predict function that calls the predict method of the multiclass strategy 'one-vs-rest'
+        (batch_size samples at a time, if given)
+        '''
+
+        check_is_fitted(self, attributes='_isfitted')
+        if self.batch_size is None:
+            return self._predict_chunk(X0)
+        return np.concatenate([self._predict_chunk(X0_chunk) for X0_chunk in self._chunks(X0)])
+
+    def _predict_chunk(self, X0: np.array):
+        '''
+        Predictions of the multiclass strategy for a chunk of test samples
         '''
 
         if (self.scaling):
             X0 = self._scobject.transform(X0)
 
+        if self.multiclass == 'native':
+            return self._predict_native(X0)
+        if isinstance(self._strategy, OneVsOneClassifier):
+            # Soft voting: the class with the largest sum of the pairwise probabilities,
+            # i.e., the class of the largest probability of predict_proba
+            return self._strategy.classes_[np.argmax(self._strategy_proba(X0), axis=1)]
         return self._strategy.predict(X0)
+
+    def predict_proba(self, X0: np.array):
+        '''
+        Class probabilities for the test samples in X0 (in the order of the sorted classes):
+        the predict_proba outputs of the global estimators are averaged over the replications
+        and combined over the binary classifiers of the strategy (batch_size samples at a time,
+        if given)
+        '''
+
+        check_is_fitted(self, attributes='_isfitted')
+        if self.batch_size is None:
+            return self._predict_proba_chunk(X0)
+        return np.concatenate([self._predict_proba_chunk(X0_chunk) for X0_chunk in self._chunks(X0)])
+
+    def _predict_proba_chunk(self, X0: np.array):
+        '''
+        Class probabilities for a chunk of test samples
+        '''
+
+        if (self.scaling):
+            X0 = self._scobject.transform(X0)
+
+        if self.multiclass == 'native':
+            X0 = check_array(X0)
+            n_classes = len(self._yorg)
+            return self._mean_proba(X0, np.arange(n_classes),
+                lambda features: np.argmax(features.reshape(len(X0), -1, n_classes).sum(axis=1), axis=1))
+        return self._strategy_proba(X0)
+
+    def _strategy_proba(self, X0: np.array):
+        '''
+        Class probabilities for (scaled) test samples combined over the binary
+        classifiers of the multiclass strategy
+        '''
+
+        # Probabilities of the positive labels of the binary problems
+        P = np.column_stack([estimator.predict_proba(X0)[:, 1] for estimator in self._strategy.estimators_])
+        n_classes = len(self._strategy.classes_)
+        if isinstance(self._strategy, OneVsRestClassifier):
+            if n_classes == 2:
+                return np.column_stack((1 - P[:, 0], P[:, 0]))
+            denom = np.sum(P, axis=1, keepdims=True)
+            proba = np.full(P.shape, 1.0/n_classes)
+            np.divide(P, denom, out=proba, where=denom > 0)
+            return proba
+        if isinstance(self._strategy, OneVsOneClassifier):
+            # Each pair (i, j) shares a unit of probability between its classes
+            proba = np.zeros((len(P), n_classes))
+            i, j = np.triu_indices(n_classes, k=1)
+            np.add.at(proba.T, j, P.T)
+            np.add.at(proba.T, i, 1 - P.T)
+            return proba / len(i)
+        # The bits of the output code are independent: the class probabilities
+        # are proportional to the likelihoods of the code words
+        code_book = self._strategy.code_book_ > 0
+        P = np.clip(P, 1.0e-8, 1 - 1.0e-8)
+        loglik = np.log(P) @ code_book.T + np.log(1 - P) @ (~code_book).T
+        proba = np.exp(loglik - np.max(loglik, axis=1, keepdims=True))
+        return proba / np.sum(proba, axis=1, keepdims=True)
+
+    def _predict_native(self, X0: np.array):
+        '''
+        Predictions of the native multiclass option: the class predicted by
+        the most replications (the smallest such class in case of ties)
+        '''
+
+        X0 = check_array(X0)
+
+        len_X0: int = len(X0)
+        n_classes = len(self._yorg)
+        votes = np.zeros((len_X0, n_classes))
+        for i in self._replication_indices():
+            global_model = self._replications[i].global_estimator
+            features = self._replication_features(X0, i)
+
+            if global_model is not None:
+                # The global estimator predicts the class indices
+                yhat = global_model.predict(features).astype(int)
+            else:
+                # The weighted local predictions are summed for each class
+                yhat = np.argmax(features.reshape(len_X0, -1, n_classes).sum(axis=1), axis=1)
+            votes[np.arange(len_X0), yhat] += 1
+
+        # Each rank adds only the votes of its own replications
+        votes = self._reduce_predictions(votes)
+        return self._yorg[np.argmax(votes, axis=1)]
     
+    def update(self, X: np.array, y: np.array):
+        '''
+        Updates the fitted model (with online set to True) with new samples, see
+        LESSRegressor.update. The binary classifiers of the multiclass strategy are
+        updated with their binary problems formed from the new samples.
+        '''
+
+        check_is_fitted(self, attributes='_isfitted')
+        if self.multiclass == 'native':
+            raise ValueError('The multiclass option \'native\' does not support update.')
+        X, y = check_X_y(X, y)
+        if not np.all(np.isin(y, self._strategy.classes_)):
+            raise ValueError('The new samples should belong to the fitted classes.')
+
+        if (self.scaling):
+            X = self._scobject.transform(X)
+
+        for estimator, (rows, labels) in zip(self._strategy.estimators_, self._binary_problems(y)):
+            if len(labels) > 0:
+                estimator.update(X[rows], labels)
+
+        return self
+
+    def _fit_strategy_warm(self, X: np.array, y: np.array):
+        '''
+        Fits the binary classifiers of the fitted strategy again with warm_start,
+        so that they keep their replications
+        '''
+
+        X, y = check_X_y(X, y)
+        if not np.array_equal(np.unique(y), self._strategy.classes_):
+            raise ValueError('The classes should not change when warm_start is set.')
+
+        for estimator, (rows, labels) in zip(self._strategy.estimators_, self._binary_problems(y)):
+            estimator.set_params(n_replications=self.n_replications, warm_start=True)
+            estimator.fit(X[rows], labels)
+
+    def _binary_problems(self, y: np.array):
+        '''
+        Returns the samples (rows) and the labels of the binary problems of the fitted
+        strategy, one for each binary classifier (formed as in sklearn.multiclass)
+        '''
+
+        classes = self._strategy.classes_
+        if isinstance(self._strategy, OneVsRestClassifier):
+            Y = self._strategy.label_binarizer_.transform(y)
+            if issparse(Y):
+                Y = Y.toarray()
+            problems = [(slice(None), Y[:, i]) for i in range(Y.shape[1])]
+        elif isinstance(self._strategy, OneVsOneClassifier):
+            problems = []
+            for i in range(len(classes)):
+                for j in range(i + 1, len(classes)):
+                    pair = (y == classes[i]) | (y == classes[j])
+                    problems.append((pair, (y[pair] == classes[j]).astype(int)))
+        else:
+            classes_index = {c: i for i, c in enumerate(classes)}
+            Y = self._strategy.code_book_[[classes_index[c] for c in y]].astype(int)
+            problems = [(slice(None), Y[:, i]) for i in range(Y.shape[1])]
+        return problems
+
     def _set_strategy(self, n_classes):
         '''
         Auxiliary function to set the selected the strategy
@@ -1012,14 +2821,56 @@ class LESSRegressor(_LESS, RegressorMixin):
         tree_method : method used for constructing the nearest neighbor tree,
                 e.g., sklearn.neighbors.KDTree (default) or sklearn.neighbors.BallTree
         cluster_method : method used for clustering the subsets,
-                e.g., sklearn.cluster.KMeans, sklearn.cluster.SpectralClustering (default is None)
+                e.g., sklearn.cluster.KMeans, sklearn.cluster.SpectralClustering, or the
+                distributed MPIKMeans (default is None)
         local_estimator : estimator for training the local models (default is LinearRegression)
         global_estimator : estimator for training the global model (default is DecisionTreeRegressor)
         distance_function : distance function evaluating the distance from a subset to a sample,
                 e.g., df(subset, sample) which returns a vector of distances
-                (default is RBF(subset, sample, 1.0/n_subsets^2))
+                (default is RBF(subset, sample, 1.0/n_subsets^2)); functions marked with
+                lessmpi.batched are called once as df(samples, centers) for all subsets
+        distance_block_size : number of samples for which the default RBF distances are evaluated
+                at a time, which bounds the temporary memory of the distance matrix (default is None,
+                all samples at once)
         scaling: flag to normalize the input data (default is True)
         warnings : flag to turn on (True) or off (False) the warnings (default is True)
+        parallel_predict : flag to distribute the replications over the MPI ranks
+                during prediction; predict then needs to be called by all ranks (default is False)
+        parallel_mode : 'subsets' (default) distributes the subsets of each replication over
+                the MPI ranks, 'replications' distributes all (replication, subset) pairs at once
+                so that the whole fit has a single synchronization point
+        scheduler : 'static' (default) assigns contiguous blocks of local models to the MPI ranks,
+                'dynamic' hands out the local models on request in the order of decreasing subset size,
+                where rank 0 acts as the master; the fitted local models are the same with both schedulers
+        shared_memory : flag to place the (scaled) training data in an MPI-3 shared-memory window,
+                so that the ranks on one node share a single copy; training data created by
+                lessmpi.shared_array is not copied if copy_X is False or scaling is off, in which case
+                it is scaled in place (default is False)
+        parallel_query : flag to grow the nearest neighbor tree on all MPI ranks and split the
+                neighbor queries of the subsets over them (default is False, only rank 0 grows and queries the tree)
+        copy_X : flag to scale a copy of the training data; if False, X is scaled in place
+                (overwritten) and the scaling statistics are computed collectively over the MPI ranks;
+                an X that is not writeable or not floating-point is still copied (default is True)
+        batch_size : number of test samples predicted at a time, which bounds the temporary
+                memory of predict; see also predict_iter (default is None, all samples at once)
+        n_nearest_subsets : number of nearest local centers (found with a tree over the centers)
+                whose local models are evaluated for each sample; the input of the global estimator is
+                then a sparse (CSR) matrix, which the global estimator must accept (default is None, all subsets)
+        warm_start : flag to keep the fitted replications (and the scaling) when fit is called
+                again, so that only the replications added by increasing n_replications are fitted;
+                with the same data, these are the replications of a fresh fit with the same
+                random_state (in either parallel_mode) (default is False)
+        online : flag to keep the sufficient statistics of the linear local estimators,
+                so that the fitted model can be updated with new samples by update(X, y); the local
+                estimator must be LinearRegression with an intercept (default is False)
+        profiler : lessmpi.Profiler object recording the time of the phases of fit and predict
+                and the bytes of the collectives on each rank; see Profiler.report (default is None, no profiling)
+        n_threads : number of threads of each MPI rank fitting its local estimators (and evaluating
+                the local estimators that are not linear in predict), so that a rank can use several cores; with
+                scheduler 'dynamic', each request of a rank is served with n_threads local estimators (default is 1)
+        online_sample_size : number of training samples kept (by reservoir sampling over fit and update)
+                when online is True, on which update(X, y) refits the global estimators; these samples
+                are not restricted to the validation samples, i.e., update ignores val_size (default is 10000)
 
     Recommendation
     --------------
@@ -1042,7 +2893,11 @@ class LESSRegressor(_LESS, RegressorMixin):
                  local_estimator=lambda: LinearRegression(),
                  global_estimator=lambda: DecisionTreeRegressor(),
                  distance_function: Callable[[np.array, np.array], np.array]=None,
-                 scaling=True, warnings=True):
+                 scaling=True, warnings=True,
+                 parallel_predict=False, parallel_mode='subsets', scheduler='static',
+                 shared_memory=False, parallel_query=False, copy_X=True, batch_size=None,
+                 n_nearest_subsets=None, warm_start=False, online=False, profiler=None,
+                 n_threads=1, online_sample_size=10000, distance_block_size=None):
 
         self.local_estimator = local_estimator
         self.global_estimator = global_estimator
@@ -1059,6 +2914,20 @@ class LESSRegressor(_LESS, RegressorMixin):
         self._rng = np.random.default_rng(self.random_state)
         self.scaling = scaling
         self.warnings = warnings
+        self.parallel_predict = parallel_predict
+        self.parallel_mode = parallel_mode
+        self.scheduler = scheduler
+        self.shared_memory = shared_memory
+        self.parallel_query = parallel_query
+        self.copy_X = copy_X
+        self.batch_size = batch_size
+        self.n_nearest_subsets = n_nearest_subsets
+        self.warm_start = warm_start
+        self.online = online
+        self.profiler = profiler
+        self.n_threads = n_threads
+        self.online_sample_size = online_sample_size
+        self.distance_block_size = distance_block_size
 
     def fit(self, X: np.array, y: np.array):
         '''
@@ -1075,11 +2944,10 @@ class LESSRegressor(_LESS, RegressorMixin):
         # Check that X and y have correct shape
         X, y = check_X_y(X, y)
 
-        self._set_local_attributes()
-        
-        if (self.scaling):
-            self._scobject = StandardScaler()
-            X = self._scobject.fit_transform(X)
+        self._prepare_fit()
+
+        with self._phase('scaling'):
+            X, window = self._scale_training_data(X)
 
         if self.val_size is not None:
             # Validation set is not used for
@@ -1095,17 +2963,78 @@ class LESSRegressor(_LESS, RegressorMixin):
                 self._fitnoval(X, y)
             else:
                 self._fitnovalc(X, y)
+        self._keep_online_sample(X, y)
 
-        self._isfitted = True
+        if window is not None:
+            window.Free()
+
+        self._finish_fit()
+
+        return self
+
+    def fit_sharded(self, X_local: np.array, y_local: np.array):
+        '''
+        Fit function for the data distributed over the MPI ranks: each rank passes
+        only its own rows (X_local, y_local) and must call fit_sharded. The scaling
+        statistics, the anchor samples and the features of the global estimator are
+        computed collectively, and the nearest neighbor rows of each subset are sent
+        to the rank that trains it. No rank holds the whole training data, except
+        that rank 0 gathers the features of the global estimator.
+
+        Clustering is not supported, and parallel_mode, scheduler, shared_memory and
+        parallel_query are ignored (the subsets are assigned in contiguous blocks).
+        '''
+
+        # Check that X and y have correct shape (a shard may be empty)
+        X_local, y_local = check_X_y(X_local, y_local, ensure_min_samples=0)
+
+        self._prepare_fit()
+
+        with self._phase('scaling'):
+            X_local = self._scale_sharded_data(X_local)
+        self._fit_sharded(X_local, y_local)
+        self._keep_online_sample(X_local, y_local, sharded=True)
+
+        self._finish_fit()
+
+        return self
+
+    def update(self, X: np.array, y: np.array):
+        '''
+        Updates the fitted model (with online set to True) with new samples: each sample
+        is routed to the subset with the nearest center in every replication, and the
+        linear local estimators of those subsets are refitted from their sufficient
+        statistics. The global estimators are refitted on a sample of the training and
+        new samples (see online_sample_size). Unlike fit, update does not keep the global
+        estimators off the samples of the local estimators, i.e., val_size is ignored.
+        '''
+
+        check_is_fitted(self, attributes='_isfitted')
+        X, y = check_X_y(X, y)
+
+        if (self.scaling):
+            X = self._scobject.transform(X)
+
+        self._update_replications(X, y)
 
         return self
 
     def predict(self, X0: np.array):
         '''
         Predictions are evaluated for the test samples in X0
+        (batch_size samples at a time, if given)
         '''
 
         check_is_fitted(self, attributes='_isfitted')
+        if self.batch_size is None:
+            return self._predict_chunk(X0)
+        return np.concatenate([self._predict_chunk(X0_chunk) for X0_chunk in self._chunks(X0)])
+
+    def _predict_chunk(self, X0: np.array):
+        '''
+        Predictions are evaluated for a chunk of test samples
+        '''
+
         # Input validation
         X0 = check_array(X0)
 
@@ -1114,38 +3043,264 @@ class LESSRegressor(_LESS, RegressorMixin):
 
         len_X0: int = len(X0)
         yhat = np.zeros(len_X0)
-        for i in range(self.n_replications):
-            # Get the fitted global and local estimators
+        for i in self._replication_indices():
+            # Get the fitted global estimator
             global_model = self._replications[i].global_estimator
-            local_models = self._replications[i].local_estimators
-            if self.cluster_method is None:
-                n_subsets = self.n_subsets
-            else:
-                n_subsets = self.n_subsets[i]
-            predicts = np.zeros((len_X0, n_subsets))
-            dists = np.zeros((len_X0, n_subsets))
-            for j in range(n_subsets):
-                local_center = local_models[j].center
-                local_model = local_models[j].estimator
-                predicts[:, j] = local_model.predict(X0)
-
-                if self.distance_function is None:
-                    dists[:, j] = rbf(X0, local_center, \
-                        coeff=1.0/np.power(n_subsets, 2.0))
-                else:
-                    dists[:, j] = self.distance_function(X0, local_center)
-
-            # Normalize the distances from samples to the local subsets
-            if self.d_normalize:
-                denom = np.sum(dists, axis=1)
-                denom[denom < 1.0e-8] = 1.0e-8
-                dists = (dists.T/denom).T
+            features = self._replication_features(X0, i)
 
             if global_model is not None:
-                yhat += global_model.predict(dists * predicts)
+                yhat += global_model.predict(features)
             else:
-                yhat += np.sum(dists * predicts, axis=1)
+                yhat += np.asarray(features.sum(axis=1)).ravel()
 
-        yhat = yhat/self.n_replications
+        yhat = self._reduce_predictions(yhat)/self.n_replications
 
         return yhat
+
+############################
+# Model files
+
+def _pickled(obj):
+    '''
+    Returns the pickled object as an array of bytes. Note that loading it runs
+    pickle, even though the .npz file itself is read without allow_pickle.
+    '''
+    return np.frombuffer(pickle.dumps(obj), dtype=np.uint8)
+
+def _unpickled(array):
+    '''
+    Inverse of _pickled (runs pickle, so only for trusted files)
+    '''
+    return pickle.loads(np.asarray(array).tobytes())
+
+def _json_default(obj):
+    '''
+    Converts the numpy scalars for json.dumps (other objects are not serializable)
+    '''
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def _is_json(value):
+    '''
+    Returns True if the value can be written by json.dumps (see _json_default)
+    '''
+    try:
+        json.dumps(value, default=_json_default)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def _json_encoded(obj):
+    '''
+    Returns the JSON text of the object as an array of bytes
+    '''
+    return np.frombuffer(json.dumps(obj, default=_json_default).encode('utf-8'), dtype=np.uint8)
+
+def _json_decoded(array):
+    '''
+    Inverse of _json_encoded
+    '''
+    return json.loads(np.asarray(array).tobytes().decode('utf-8'))
+
+def _model_units(model):
+    '''
+    Returns the fitted LESS models holding the replications of a LESSRegressor
+    (the model itself) or a LESSClassifier (the binary classifiers of the strategy,
+    or the model itself for the multiclass option 'native')
+    '''
+    if isinstance(model, LESSClassifier) and model.multiclass != 'native':
+        return model._strategy.estimators_
+    return [model]
+
+def save_model(model, file):
+    '''
+    Saves a fitted LESSRegressor or LESSClassifier to an uncompressed .npz file
+
+    The centers of the local models of all replications are stored in a single
+    contiguous array (the subsets of the r-th replication are the rows
+    offsets[r]:offsets[r+1]), and so are the coefficients and the intercepts when
+    all local estimators are linear. The global estimators (and the local estimators
+    that are not linear) are pickled, and so are the constant predictors that sklearn
+    uses for the binary problems of a multiclass strategy with a single label. The other
+    attributes (the parameters, the scaling and the multiclass strategy) are stored as
+    JSON and arrays. Parameters that are callable or not JSON serializable (e.g., a
+    np.random.Generator as random_state) are not saved, so a custom distance_function
+    must be passed again to load_model. The file must be written by a rank holding all
+    replications (rank 0, or any rank with parallel_predict, which also holds the
+    replications updated by the other ranks).
+    '''
+
+    check_is_fitted(model, attributes='_isfitted')
+    arrays = {}
+    units = []
+    for u, unit in enumerate(_model_units(model)):
+        if not isinstance(unit, _LESS):
+            arrays[f'unit{u}_estimator'] = _pickled(unit)
+            units.append({'constant': True})
+            continue
+        if len(unit._replications) != unit.n_replications:
+            raise ValueError('The model can be saved only by a rank holding all replications.')
+        offsets = np.cumsum([0] + [len(compiled.centers) for compiled in unit._compiled])
+        arrays[f'unit{u}_offsets'] = offsets
+        arrays[f'unit{u}_centers'] = np.concatenate([compiled.centers for compiled in unit._compiled])
+        linear = all(compiled.coefs is not None for compiled in unit._compiled)
+        if linear:
+            arrays[f'unit{u}_coefs'] = np.concatenate([compiled.coefs for compiled in unit._compiled])
+            arrays[f'unit{u}_intercepts'] = np.concatenate([compiled.intercepts for compiled in unit._compiled])
+        else:
+            arrays[f'unit{u}_local_estimators'] = _pickled(
+                [[local_model.estimator for local_model in replication.local_estimators]
+                 for replication in unit._replications])
+        arrays[f'unit{u}_global_estimators'] = _pickled(
+            [replication.global_estimator for replication in unit._replications])
+        if getattr(unit, '_yorg', None) is not None:
+            arrays[f'unit{u}_yorg'] = np.asarray(unit._yorg)
+        units.append({'n_replications': int(unit.n_replications), 'd_normalize': bool(unit.d_normalize),
+                      'linear': linear, 'yorg': getattr(unit, '_yorg', None) is not None})
+
+    # The scaling object is set only if scaling is used
+    scobject = getattr(model, '_scobject', None)
+    meta = {'class': type(model).__name__,
+            'params': {name: value for name, value in model.get_params().items()
+                       if not callable(value) and _is_json(value)},
+            'distance_function': model.distance_function is not None,
+            'scaling': scobject is not None,
+            'units': units}
+    if scobject is not None:
+        arrays['scaler_mean'] = scobject.mean_
+        arrays['scaler_var'] = scobject.var_
+        arrays['scaler_scale'] = scobject.scale_
+        meta['n_samples_seen'] = np.asarray(scobject.n_samples_seen_).tolist()
+    if isinstance(model, LESSClassifier) and model.multiclass != 'native':
+        strategy = model._strategy
+        arrays['strategy_classes'] = np.asarray(strategy.classes_)
+        meta['code_book'] = hasattr(strategy, 'code_book_')
+        if meta['code_book']:
+            arrays['strategy_code_book'] = strategy.code_book_
+        # The label binarizer (one-vs-rest) is fitted again on the classes by load_model
+        meta['strategy'] = {name: value for name, value in vars(strategy).items()
+                            if name not in ('estimator', 'estimators_', 'classes_', 'code_book_',
+                                            'label_binarizer_') and _is_json(value)}
+        if hasattr(strategy, 'label_binarizer_'):
+            meta['sparse_output'] = strategy.label_binarizer_.sparse_output
+    arrays['meta'] = _json_encoded(meta)
+    np.savez(file, **arrays)
+
+def _npz_memmap(file, mmap_mode='r'):
+    '''
+    Returns the arrays of an uncompressed .npz file (as written by np.savez)
+    memory-mapped with the given mode, without reading their data
+    '''
+    arrays = {}
+    with zipfile.ZipFile(file) as archive, open(file, 'rb') as fp:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('Only uncompressed .npz files can be memory-mapped.')
+            # The member data follows its local header (30 bytes, name and extra field)
+            fp.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', fp.read(30)[26:30])
+            fp.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(file, dtype=dtype, mode=mmap_mode, offset=fp.tell(),
+                                         shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+def load_model(file, distance_function=None, mmap_mode=None):
+    '''
+    Loads a LESSRegressor or LESSClassifier saved by save_model. The model predicts
+    with the stored arrays; the local estimators of linear local models are not
+    restored (LocalModelR.estimator is None). The replications are not distributed
+    over the ranks, i.e., parallel_predict is turned off.
+
+    Only files from a trusted source may be loaded: the global estimators (and the
+    local estimators that are not linear) are unpickled, which can run arbitrary code.
+
+    With mmap_mode='r', the centers, coefficients and intercepts are memory-mapped
+    read-only from the file (and used as such by predict), so that the processes
+    loading the same file share one physical copy of them.
+    '''
+
+    if mmap_mode is None:
+        with np.load(file) as data:
+            return _load_model(data, distance_function)
+    return _load_model(_npz_memmap(file, mmap_mode), distance_function)
+
+def _load_model(data, distance_function):
+    '''
+    Builds the model from the arrays of a model file (see load_model)
+    '''
+
+    meta = _json_decoded(data['meta'])
+    if meta['distance_function'] and distance_function is None:
+        raise ValueError('The model was fitted with a custom distance_function, which must be given.')
+    params = dict(meta['params'], parallel_predict=False)
+    if distance_function is not None:
+        params['distance_function'] = distance_function
+    model = (LESSClassifier if meta['class'] == 'LESSClassifier' else LESSRegressor)(**params)
+    if meta['scaling']:
+        model._scobject = StandardScaler()
+        model._scobject.mean_ = np.array(data['scaler_mean'])
+        model._scobject.var_ = np.array(data['scaler_var'])
+        model._scobject.scale_ = np.array(data['scaler_scale'])
+        model._scobject.n_samples_seen_ = np.asarray(meta['n_samples_seen']) \
+            if isinstance(meta['n_samples_seen'], list) else meta['n_samples_seen']
+        model._scobject.n_features_in_ = len(model._scobject.mean_)
+
+    units = []
+    for u, unit_meta in enumerate(meta['units']):
+        if unit_meta.get('constant', False):
+            units.append(_unpickled(data[f'unit{u}_estimator']))
+            continue
+        unit = clone(model._bclassifier) if 'strategy' in meta else model
+        offsets = data[f'unit{u}_offsets']
+        centers = data[f'unit{u}_centers']
+        global_estimators = _unpickled(data[f'unit{u}_global_estimators'])
+        if unit_meta['linear']:
+            coefs, intercepts = data[f'unit{u}_coefs'], data[f'unit{u}_intercepts']
+        else:
+            local_estimators = _unpickled(data[f'unit{u}_local_estimators'])
+        unit._replications, unit._compiled = [], []
+        for r in range(unit_meta['n_replications']):
+            start, stop = offsets[r], offsets[r+1]
+            if unit_meta['linear']:
+                estimators = [None for _ in range(start, stop)]
+                unit._compiled.append(CompiledReplicationR(centers[start:stop], coefs[start:stop],
+                                                           intercepts[start:stop]))
+            else:
+                estimators = local_estimators[r]
+                unit._compiled.append(CompiledReplicationR(centers[start:stop], None, None))
+            unit._replications.append(ReplicationR(global_estimators[r],
+                [LocalModelR(estimator=estimator, center=center)
+                 for estimator, center in zip(estimators, centers[start:stop])]))
+        unit.n_replications = unit_meta['n_replications']
+        unit.d_normalize = unit_meta['d_normalize']
+        if unit_meta['yorg']:
+            unit._yorg = np.array(data[f'unit{u}_yorg'])
+        unit._n_fitted = unit_meta['n_replications']
+        unit._isfitted = True
+        units.append(unit)
+
+    if 'strategy' in meta:
+        classes = np.array(data['strategy_classes'])
+        model._set_strategy(len(classes))
+        for name, value in meta['strategy'].items():
+            setattr(model._strategy, name, value)
+        model._strategy.classes_ = classes
+        if meta['code_book']:
+            model._strategy.code_book_ = np.array(data['strategy_code_book'])
+        if 'sparse_output' in meta:
+            model._strategy.label_binarizer_ = LabelBinarizer(sparse_output=meta['sparse_output']).fit(classes)
+        model._strategy.estimators_ = units
+        if len(classes) == 2 and isinstance(units[0], _LESS):
+            model._replications = units[0]._replications
+        model._isfitted = True
+    return model
@@ -0,0 +1,548 @@
+'''
+Tests of LESS-MPI, which are run on one or more MPI ranks, e.g.,
+
+    mpirun -n 1 python -m pytest -q -p no:cacheprovider tests
+    mpirun -n 2 python -m pytest -q -p no:cacheprovider tests
+
+Every rank runs every test, so that the collectives of fit and predict match.
+The reference models are fitted by rank 0 alone (see serial), and the results
+are broadcast from rank 0 before they are checked, so that all ranks pass or
+fail together.
+'''
+import json
+import os
+import tempfile
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+from mpi4py import MPI
+from sklearn.cluster import KMeans
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.linear_model import LinearRegression, LogisticRegression, Ridge
+from sklearn.neighbors import KDTree
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+
+import lessmpi.lessmpi as lessmpi
+from lessmpi import (IVFIndex, LESSClassifier, LESSRegressor, MPIKMeans, Profiler, batched, load_model,
+                     rbf_batch, save_model, shared_array)
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+
+warnings.filterwarnings('ignore')
+
+
+@contextmanager
+def serial():
+    '''
+    Runs LESS on rank 0 alone (MPI.COMM_SELF) within the context
+    '''
+    saved = lessmpi.comm, lessmpi.number_of_workers, lessmpi.rank, lessmpi._node_comm
+    lessmpi.comm, lessmpi.number_of_workers, lessmpi.rank, lessmpi._node_comm = MPI.COMM_SELF, 1, 0, MPI.COMM_SELF
+    try:
+        yield
+    finally:
+        lessmpi.comm, lessmpi.number_of_workers, lessmpi.rank, lessmpi._node_comm = saved
+
+
+def on_root(function):
+    '''
+    Returns the output of function evaluated on rank 0 (broadcast to all ranks)
+    '''
+    output = None
+    if rank == 0:
+        output = function()
+    return comm.bcast(output, root=0)
+
+
+def reference(make_model, X, y, X0):
+    '''
+    Predictions for X0 of the model fitted by rank 0 alone
+    '''
+    def fit_predict():
+        with serial():
+            return make_model().fit(X, y).predict(X0)
+    return on_root(fit_predict)
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 4))
+    y = X @ np.arange(1, 5) + np.sin(3 * X[:, 0])
+    X0 = rng.normal(size=(50, 4))
+    return X, y, X0
+
+
+def regressor(**params):
+    '''
+    Returns a maker of LESSRegressor with random local estimators
+    '''
+    return lambda: LESSRegressor(n_replications=4, random_state=1, warnings=False,
+                                 local_estimator=lambda: ExtraTreesRegressor(n_estimators=5),
+                                 global_estimator=lambda: Ridge(), **params)
+
+
+@pytest.mark.parametrize('params', [{}, {'parallel_mode': 'replications'}, {'n_threads': 2},
+                                    {'val_size': 0.3}, {'n_nearest_subsets': 3},
+                                    {'parallel_query': True},
+                                    {'cluster_method': lambda: KMeans(n_clusters=5, n_init=3)},
+                                    {'cluster_method': lambda: KMeans(n_clusters=5, n_init=3), 'val_size': 0.3},
+                                    {'tree_method': lambda data, n_subsets: IVFIndex(data, n_probe=2)},
+                                    {'tree_method': lambda data, n_subsets: IVFIndex(data, n_probe=2),
+                                     'parallel_query': True}],
+                         ids=['default', 'replications', 'threads', 'val_size', 'nearest', 'query',
+                              'kmeans', 'kmeans_val_size', 'ivf', 'ivf_query'])
+def test_fit_does_not_depend_on_ranks(data, params):
+    X, y, X0 = data
+    expected = reference(regressor(**params), X, y, X0)
+    model = regressor(**params)().fit(X, y)
+    yhat = on_root(lambda: model.predict(X0))
+    np.testing.assert_allclose(yhat, expected)
+
+
+def test_parallel_predict(data):
+    X, y, X0 = data
+    expected = reference(regressor(), X, y, X0)
+    # All ranks predict, each with its own replications
+    yhat = regressor(parallel_predict=True)().fit(X, y).predict(X0)
+    for yhat_rank in comm.allgather(yhat):
+        np.testing.assert_allclose(yhat_rank, expected)
+
+
+@pytest.mark.parametrize('val_size', [None, 0.3])
+def test_parallel_modes_agree(data, val_size):
+    X, y, X0 = data
+    subsets = regressor(val_size=val_size)().fit(X, y)
+    replications = regressor(val_size=val_size, parallel_mode='replications')().fit(X, y)
+    yhat = on_root(lambda: replications.predict(X0))
+    np.testing.assert_allclose(yhat, on_root(lambda: subsets.predict(X0)))
+
+
+@pytest.mark.parametrize('parallel_mode', ['subsets', 'replications'])
+def test_warm_start_matches_fresh_fit(data, parallel_mode):
+    X, y, X0 = data
+    model = regressor(warm_start=True, parallel_mode=parallel_mode)().set_params(n_replications=2).fit(X, y)
+    model.set_params(n_replications=4).fit(X, y)
+    yhat = on_root(lambda: model.predict(X0))
+    expected = reference(regressor(), X, y, X0)
+    np.testing.assert_allclose(yhat, expected)
+
+
+def test_warm_start_classifier_matches_fresh_fit(data):
+    X, y, X0 = data
+    y = np.digitize(y, np.quantile(y, [0.3, 0.6]))
+    model = LESSClassifier(n_replications=2, random_state=1, warnings=False, warm_start=True).fit(X, y)
+    model.set_params(n_replications=4).fit(X, y)
+    yhat = on_root(lambda: model.predict_proba(X0))
+    expected = on_root(lambda: _serial_classifier(X, y, X0))
+    np.testing.assert_allclose(yhat, expected)
+
+
+def _serial_classifier(X, y, X0):
+    with serial():
+        return LESSClassifier(n_replications=4, random_state=1, warnings=False).fit(X, y).predict_proba(X0)
+
+
+def test_dynamic_scheduler_is_reproducible(data):
+    X, y, X0 = data
+    expected = reference(regressor(), X, y, X0)
+    for n_threads in (1, 2):
+        for _ in range(2):
+            model = regressor(scheduler='dynamic', n_threads=n_threads)().fit(X, y)
+            yhat = on_root(lambda: model.predict(X0))
+            np.testing.assert_allclose(yhat, expected)
+
+
+@pytest.mark.parametrize('n_nearest_subsets', [None, 3])
+def test_fit_sharded(data, n_nearest_subsets):
+    X, y, X0 = data
+    # Without scaling, the sharded fit does not depend on the rank count
+    make_model = regressor(n_nearest_subsets=n_nearest_subsets, scaling=False)
+    expected = on_root(lambda: _serial_sharded(make_model, X, y, X0))
+    model = make_model().fit_sharded(*_shard(X, y))
+    yhat = on_root(lambda: model.predict(X0))
+    np.testing.assert_allclose(yhat, expected)
+
+
+def test_fit_sharded_with_scaling(data):
+    X, y, X0 = data
+    expected = on_root(lambda: _serial_sharded(regressor(), X, y, X0))
+    model = regressor()().fit_sharded(*_shard(X, y))
+    yhat = on_root(lambda: model.predict(X0))
+    # The scaling statistics are reduced over the shards, so they agree up to rounding
+    np.testing.assert_allclose(yhat, expected, rtol=1e-4)
+
+
+def _shard(X, y):
+    n_ranks = comm.Get_size()
+    rows = slice(rank * len(X) // n_ranks, (rank + 1) * len(X) // n_ranks)
+    return X[rows], y[rows]
+
+
+def _serial_sharded(make_model, X, y, X0):
+    with serial():
+        return make_model().fit_sharded(X, y).predict(X0)
+
+
+@pytest.mark.parametrize('scaling', [False, True])
+def test_shared_memory(data, scaling):
+    X, y, X0 = data
+    expected = reference(regressor(scaling=scaling), X, y, X0)
+    # Without scaling, the training data created by shared_array is used as such
+    X_shared = shared_array(X if lessmpi.get_node_comm().Get_rank() == 0 else None)
+    model = regressor(shared_memory=True, copy_X=False, scaling=scaling)().fit(X_shared.copy() if scaling
+                                                                                 else X_shared, y)
+    yhat = on_root(lambda: model.predict(X0))
+    np.testing.assert_allclose(yhat, expected)
+    np.testing.assert_array_equal(X_shared, X)
+
+
+def test_shared_memory_integer_data(data):
+    X, y, X0 = data
+    X = np.round(10 * X).astype(int)
+    expected = reference(regressor(), X, y, X0)
+    model = regressor(shared_memory=True)().fit(X, y)
+    yhat = on_root(lambda: model.predict(X0))
+    np.testing.assert_allclose(yhat, expected)
+
+
+@pytest.mark.parametrize('make_model', [
+    lambda: LESSRegressor(n_replications=3, random_state=0, warnings=False),
+    lambda: LESSRegressor(n_replications=3, random_state=0, warnings=False,
+                          local_estimator=lambda: DecisionTreeRegressor()),
+    lambda: LESSClassifier(n_replications=3, random_state=0, warnings=False),
+    lambda: LESSClassifier(n_replications=3, random_state=0, warnings=False, multiclass='ovo'),
+    lambda: LESSClassifier(n_replications=3, random_state=0, warnings=False, multiclass='native')],
+    ids=['linear', 'tree', 'ovr', 'ovo', 'native'])
+@pytest.mark.parametrize('mmap_mode', [None, 'r'])
+def test_save_load(data, make_model, mmap_mode):
+    X, y, X0 = data
+    if isinstance(make_model(), LESSClassifier):
+        y = np.digitize(y, np.quantile(y, [0.3, 0.6]))
+    model = make_model().fit(X, y)
+
+    def round_trip():
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'model.npz')
+            save_model(model, file)
+            # The metadata is read without unpickling
+            with np.load(file, allow_pickle=False) as arrays:
+                json.loads(arrays['meta'].tobytes().decode())
+            loaded = load_model(file, mmap_mode=mmap_mode)
+            outputs = [np.array_equal(loaded.predict(X0), model.predict(X0))]
+            if isinstance(model, LESSClassifier):
+                outputs.append(np.allclose(loaded.predict_proba(X0), model.predict_proba(X0)))
+            del loaded
+            return outputs
+
+    assert all(on_root(round_trip))
+
+
+def test_memory_mapped_arrays(data):
+    X, y, X0 = data
+    model = LESSRegressor(n_replications=3, random_state=0, warnings=False).fit(X, y)
+
+    def mapped():
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'model.npz')
+            save_model(model, file)
+            arrays = lessmpi._npz_memmap(file)
+            with np.load(file) as loaded:
+                outputs = [sorted(arrays) == sorted(loaded.files)]
+                outputs.extend(np.array_equal(arrays[name], loaded[name]) for name in loaded.files)
+            outputs.append(any(isinstance(array, np.memmap) for array in arrays.values()))
+            del arrays
+            return outputs
+
+    assert all(on_root(mapped))
+
+
+def _online_data(data):
+    X, y, X0 = data
+    rng = np.random.default_rng(1)
+    X_new = rng.normal(size=(100, 4))
+    return X, y, X_new, X_new @ np.arange(1, 5) + np.sin(3 * X_new[:, 0]), X0
+
+
+def test_update_matches_refit(data):
+    X, y, X_new, y_new, X0 = _online_data(data)
+    # With a single subset, the local models are fitted on all samples, and the
+    # prediction (without a global estimator) is that of the local model
+    model = LESSRegressor(n_subsets=1, n_replications=2, random_state=0, warnings=False, scaling=False,
+                          global_estimator=None, online=True).fit(X, y)
+    model.update(X_new, y_new)
+    X_all, y_all = np.concatenate((X, X_new)), np.concatenate((y, y_new))
+    Z_all = np.column_stack((np.ones(len(X_all)), X_all))
+    for replication in on_root(lambda: model._replications):
+        gram, moment = replication.local_estimators[0].stats
+        np.testing.assert_allclose(gram, Z_all.T @ Z_all)
+        np.testing.assert_allclose(moment, Z_all.T @ y_all)
+        np.testing.assert_allclose(replication.local_estimators[0].center, np.mean(X_all, axis=0))
+    yhat = on_root(lambda: model.predict(X0))
+    np.testing.assert_allclose(yhat, LinearRegression().fit(X_all, y_all).predict(X0))
+
+
+def test_update_adds_the_statistics_of_the_nearest_subset(data):
+    X, y, X_new, y_new, X0 = _online_data(data)
+    model = LESSRegressor(n_subsets=5, n_replications=2, random_state=0, warnings=False, scaling=False,
+                          online=True).fit(X, y)
+    before = on_root(lambda: (model._replications, [compiled.centers.copy() for compiled in model._compiled]))
+    model.update(X_new, y_new)
+    after = on_root(lambda: model._replications)
+    Z_new = np.column_stack((np.ones(len(X_new)), X_new))
+    for replication, centers, updated in zip(*before, after):
+        nearest = np.argmin(((X_new[:, None, :] - centers[None, :, :])**2).sum(axis=2), axis=1)
+        for s, (local_model, local_update) in enumerate(zip(replication.local_estimators,
+                                                            updated.local_estimators)):
+            rows = nearest == s
+            np.testing.assert_allclose(local_update.stats[0], local_model.stats[0] + Z_new[rows].T @ Z_new[rows])
+            np.testing.assert_allclose(local_update.stats[1], local_model.stats[1] + Z_new[rows].T @ y_new[rows])
+            # The least squares solution of the subset with the new samples
+            theta = np.linalg.solve(local_update.stats[0], local_update.stats[1])
+            np.testing.assert_allclose(local_update.estimator.coef_, theta[1:])
+            np.testing.assert_allclose(local_update.estimator.intercept_, theta[0])
+
+
+def test_update_with_parallel_predict(data):
+    X, y, X_new, y_new, X0 = _online_data(data)
+    model = LESSRegressor(n_replications=3, random_state=0, warnings=False, online=True,
+                          parallel_predict=True).fit(X, y)
+    model.update(X_new, y_new)
+    expected = on_root(lambda: _serial_update(X, y, X_new, y_new, X0))
+    # Every rank holds all updated replications
+    model.set_params(parallel_predict=False)
+    for yhat_rank in comm.allgather(model.predict(X0)):
+        np.testing.assert_allclose(yhat_rank, expected)
+
+
+def _serial_update(X, y, X_new, y_new, X0):
+    with serial():
+        model = LESSRegressor(n_replications=3, random_state=0, warnings=False, online=True).fit(X, y)
+        return model.update(X_new, y_new).predict(X0)
+
+
+def test_online_requires_linear_regression(data):
+    X, y, X0 = data
+    with pytest.raises(ValueError):
+        LESSRegressor(n_replications=2, warnings=False, online=True,
+                      local_estimator=lambda: Ridge()).fit(X, y)
+
+
+def test_online_warns_that_update_ignores_val_size(data):
+    X, y, X0 = data
+    with pytest.warns(UserWarning, match='val_size'):
+        LESSRegressor(n_replications=2, random_state=0, online=True, val_size=0.3).fit(X, y)
+
+
+@pytest.mark.parametrize('batch_size', [None, 100])
+def test_mpikmeans_does_not_depend_on_ranks(data, batch_size):
+    X, y, X0 = data
+
+    def serial_fit():
+        with serial():
+            kmeans = MPIKMeans(n_clusters=5, batch_size=batch_size, random_state=0).fit(X)
+            return kmeans.labels_, kmeans.cluster_centers_
+
+    labels, centers = serial_fit() if rank == 0 else (None, None)
+    labels, centers = comm.bcast((labels, centers), root=0)
+    kmeans = MPIKMeans(n_clusters=5, batch_size=batch_size, random_state=0).fit(X)
+    np.testing.assert_array_equal(kmeans.labels_, labels)
+    # The centroid sums are reduced over the ranks
+    np.testing.assert_allclose(kmeans.cluster_centers_, centers)
+
+
+def test_mpikmeans_matches_kmeans(data):
+    X, y, X0 = data
+    kmeans = MPIKMeans(n_clusters=5, tol=0, max_iter=300, random_state=0).fit(X)
+    # The initial centroids chosen by rank 0
+    init = X[MPIKMeans(n_clusters=5)._init_centers(X, np.random.default_rng(0))]
+    expected = KMeans(n_clusters=5, init=init, n_init=1, tol=0, max_iter=300, algorithm='lloyd').fit(X)
+    np.testing.assert_array_equal(kmeans.labels_, expected.labels_)
+    np.testing.assert_allclose(kmeans.cluster_centers_, expected.cluster_centers_)
+    np.testing.assert_allclose(kmeans.inertia_, expected.inertia_)
+
+
+@pytest.mark.parametrize('multiclass', ['ovr', 'ovo', 'native'])
+def test_predict_proba(data, multiclass):
+    X, y, X0 = data
+    y = np.digitize(y, np.quantile(y, [0.25, 0.5, 0.75]))
+    model = LESSClassifier(n_replications=3, random_state=0, warnings=False, multiclass=multiclass).fit(X, y)
+    proba, yhat = on_root(lambda: (model.predict_proba(X0), model.predict(X0)))
+    np.testing.assert_allclose(proba.sum(axis=1), 1)
+    # The predicted class has the largest probability (ties may be broken otherwise)
+    predicted = proba[np.arange(len(X0)), np.searchsorted(np.unique(y), yhat)]
+    np.testing.assert_array_equal(predicted, proba.max(axis=1))
+
+
+def _binary_proba(model, X0):
+    '''
+    Mean of the probabilities of the global estimators of a binary classifier
+    '''
+    estimator = model._strategy.estimators_[0]
+    X0 = model._scobject.transform(X0)
+    return np.mean([replication.global_estimator.predict_proba(estimator._replication_features(X0, i))
+                    for i, replication in enumerate(estimator._replications)], axis=0)
+
+
+def test_binary_predict_proba(data):
+    X, y, X0 = data
+    y = (y > 0).astype(int)
+    model = LESSClassifier(n_replications=3, random_state=0, warnings=False,
+                           global_estimator=lambda: LogisticRegression()).fit(X, y)
+    proba, expected = on_root(lambda: (model.predict_proba(X0), _binary_proba(model, X0)))
+    np.testing.assert_allclose(proba, expected)
+
+
+@pytest.mark.parametrize('n_classes', [2, 3])
+def test_predict_proba_with_global_regressor(data, n_classes):
+    X, y, X0 = data
+    y = np.digitize(y, np.quantile(y, np.arange(1, n_classes) / n_classes))
+    # A global regressor votes for the label nearest to its prediction
+    model = LESSClassifier(n_replications=3, random_state=0, warnings=False,
+                           global_estimator=lambda: LinearRegression()).fit(X, y)
+    proba = on_root(lambda: model.predict_proba(X0))
+    np.testing.assert_allclose(proba.sum(axis=1), 1)
+    if n_classes == 2:
+        def votes():
+            estimator = model._strategy.estimators_[0]
+            X0_scaled = model._scobject.transform(X0)
+            return np.mean([replication.global_estimator.predict(estimator._replication_features(X0_scaled, i)) >= 0
+                            for i, replication in enumerate(estimator._replications)], axis=0)
+        np.testing.assert_allclose(proba[:, 1], on_root(votes))
+
+
+@pytest.mark.parametrize('block_size', [None, 7, 1000])
+def test_rbf_batch(data, block_size):
+    X, y, X0 = data
+    centers = X0[:10]
+    expected = np.column_stack([lessmpi.rbf(X, center, coeff=0.1) for center in centers])
+    np.testing.assert_allclose(rbf_batch(X, centers, coeff=0.1, block_size=block_size), expected)
+
+
+def test_distance_block_size(data):
+    X, y, X0 = data
+    model = regressor()().fit(X, y)
+    blocked = regressor(distance_block_size=7)().fit(X, y)
+    np.testing.assert_allclose(on_root(lambda: blocked.predict(X0)), on_root(lambda: model.predict(X0)))
+
+
+def test_batched_distance_function(data):
+    X, y, X0 = data
+    model = regressor(distance_function=lambda data, center: lessmpi.rbf(data, center, coeff=0.1))().fit(X, y)
+    batched_model = regressor(distance_function=batched(lambda data, centers: rbf_batch(data, centers,
+                                                                                       coeff=0.1)))().fit(X, y)
+    np.testing.assert_allclose(on_root(lambda: batched_model.predict(X0)), on_root(lambda: model.predict(X0)))
+
+
+def test_distance_block_size_must_be_positive(data):
+    X, y, X0 = data
+    with pytest.raises(ValueError):
+        regressor(distance_block_size=0)().fit(X, y)
+
+
+@pytest.mark.parametrize('to_input', [lambda X0: X0, lambda X0: X0.tolist()], ids=['array', 'list'])
+def test_batch_size(data, to_input):
+    X, y, X0 = data
+    model = regressor()().fit(X, y)
+    yc = np.digitize(y, np.quantile(y, [0.3, 0.6]))
+    classifier = LESSClassifier(n_replications=3, random_state=0, warnings=False).fit(X, yc)
+
+    def chunked():
+        expected = model.predict(X0), classifier.predict(X0), classifier.predict_proba(X0)
+        model.set_params(batch_size=7)
+        classifier.set_params(batch_size=7)
+        outputs = model.predict(to_input(X0)), classifier.predict(to_input(X0)), \
+            classifier.predict_proba(to_input(X0))
+        return expected, outputs
+
+    expected, outputs = on_root(chunked)
+    for output, expected_output in zip(outputs, expected):
+        np.testing.assert_allclose(output, expected_output)
+
+
+def test_predict_iter(data):
+    X, y, X0 = data
+    model = regressor(batch_size=7)().fit(X, y)
+
+    def chunks():
+        expected = model.predict(X0)
+        # An array is read batch_size rows at a time, and an iterator chunk by chunk
+        array_chunks = list(model.predict_iter(X0))
+        stream_chunks = list(model.predict_iter(X0[start:start+11] for start in range(0, len(X0), 11)))
+        list_chunks = list(model.predict_iter(X0.tolist()))
+        return expected, array_chunks, stream_chunks, list_chunks
+
+    expected, array_chunks, stream_chunks, list_chunks = on_root(chunks)
+    assert [len(chunk) for chunk in array_chunks] == [7] * 7 + [1]
+    assert [len(chunk) for chunk in stream_chunks] == [11] * 4 + [6]
+    for chunks in (array_chunks, stream_chunks, list_chunks):
+        np.testing.assert_allclose(np.concatenate(chunks), expected)
+
+
+@pytest.mark.parametrize('n_probe', [10, 20])
+def test_ivf_index_is_exact_with_all_lists(data, n_probe):
+    X, y, X0 = data
+    dists, indices = IVFIndex(X, n_lists=10, n_probe=n_probe).query(X0, k=5)
+    expected_dists, expected_indices = KDTree(X).query(X0, k=5)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(dists, expected_dists)
+
+
+def test_ivf_index_returns_k_neighbors(data):
+    X, y, X0 = data
+    # A single probed list may hold fewer than k samples
+    dists, indices = IVFIndex(X, n_lists=30, n_probe=1).query(X0, k=40)
+    assert indices.shape == (len(X0), 40)
+    assert all(len(np.unique(row)) == 40 for row in indices)
+    assert np.all(np.diff(dists, axis=1) >= 0)
+
+
+def test_profiler_report(data):
+    X, y, X0 = data
+    profiler = Profiler()
+    model = regressor(profiler=profiler, parallel_predict=True)().fit(X, y)
+    model.predict(X0)
+    phases = comm.gather(set(profiler.phases), root=0)
+    report = profiler.report()
+    if rank == 0:
+        report = json.loads(json.dumps(report))
+    report, phases = comm.bcast((report, phases), root=0)
+    n_ranks = comm.Get_size()
+    assert report['n_ranks'] == n_ranks
+    # One entry per phase of any rank, with the records of every rank
+    assert set(report['phases']) == set().union(*phases)
+    for record in report['phases'].values():
+        assert len(record['seconds']) == len(record['calls']) == n_ranks
+        assert record['imbalance'] >= 1.0
+        assert record['max'] >= record['mean']
+    # The pickled local models and replications are counted with the buffers
+    for name in ('neighbors_comm', 'features_comm', 'local_models_comm', 'share_replications'):
+        assert report['communication'][name]['total'] > 0
+    assert report['communication']['share_replications']['bytes'][1:] == [0] * (n_ranks - 1)
+
+
+def test_copy_X(data):
+    X, y, X0 = data
+    expected = reference(regressor(), X, y, X0)
+    X_copy = X.copy()
+    model = regressor(copy_X=True)().fit(X_copy, y)
+    np.testing.assert_array_equal(X_copy, X)
+    np.testing.assert_allclose(on_root(lambda: model.predict(X0)), expected)
+    # Without copy_X, X is scaled in place
+    model = regressor(copy_X=False)().fit(X_copy, y)
+    np.testing.assert_allclose(X_copy, StandardScaler().fit_transform(X))
+    np.testing.assert_allclose(on_root(lambda: model.predict(X0)), expected)
+
+
+def test_copy_X_read_only(data):
+    X, y, X0 = data
+    expected = reference(regressor(), X, y, X0)
+    X_read_only = X.copy()
+    X_read_only.flags.writeable = False
+    model = regressor(copy_X=False)().fit(X_read_only, y)
+    np.testing.assert_array_equal(X_read_only, X)
+    np.testing.assert_allclose(on_root(lambda: model.predict(X0)), expected)